@@ -1,7 +1,9 @@
 from django.shortcuts import render
 from rest_framework.views import APIView
 from apps.songs.models import Song, Genre
+from apps.songs.chunk_cache import get_chunk_cache
 from rest_framework.permissions import IsAuthenticated
+from apps.users.views import IsAdminRole
 from rest_framework.response import Response
 from apps.admin_analytics.serializers import (
     SongStatSerializer,
@@ -11,6 +13,7 @@ from apps.admin_analytics.serializers import (
 from apps.listenedAt.models import ListenedAt
 from apps.downloadedAt.models import DownloadedAt
 from django.utils import timezone
+from utils.reference_loader import get_reference_loader
 import datetime
 from reportlab.lib import colors
 from reportlab.lib.pagesizes import letter
@@ -24,9 +27,39 @@ import io
 class TopSongsView(APIView):
     permission_classes = [IsAuthenticated]
 
+    def get_all_time(self, request, sort_by, limit):
+        # Read the denormalized counters straight from the indexed fields
+        if sort_by not in ("play_count", "download_count"):
+            sort_by = "play_count"
+
+        songs = Song.objects(deleted_at=None).order_by(f"-{sort_by}").limit(limit)
+        # Every artist in one query instead of one per row
+        songs = get_reference_loader({"request": request}).load(songs, "user")
+
+        results = [
+            {
+                "id": str(song.id),
+                "title": song.title,
+                "artist_name": song.user.name if song.user else "Unknown",
+                "play_count": song.play_count,
+                "download_count": song.download_count,
+            }
+            for song in songs
+        ]
+
+        serializer = SongStatSerializer(results, many=True)
+        return Response(
+            {"results": serializer.data, "time_range_days": None, "sorted_by": sort_by}
+        )
+
     def get(self, request):
         limit = int(request.query_params.get("limit", 20))
         time_range = request.query_params.get("range", "30")
+        if time_range == "all":
+            return self.get_all_time(
+                request, request.query_params.get("sort_by", "play_count"), limit
+            )
+
         days = int(time_range)
         start_date = timezone.now() - datetime.timedelta(days=days)
 
@@ -41,7 +74,10 @@ class TopSongsView(APIView):
             download_counts[song_id] = download_counts.get(song_id, 0) + 1
 
         results = []
-        for song in Song.objects.all():
+        songs = get_reference_loader({"request": request}).load(
+            Song.objects.all(), "user"
+        )
+        for song in songs:
             song_id = str(song.id)
             play_count = play_counts.get(song_id, 0)
             download_count = download_counts.get(song_id, 0)
@@ -345,3 +381,12 @@ class ExportPDFView(APIView):
         buffer.close()
         response.write(pdf)
         return response
+
+
+class MediaCacheStatsView(APIView):
+    """Hit/miss/eviction counters of this process' GridFS chunk cache"""
+
+    permission_classes = [IsAuthenticated, IsAdminRole]
+
+    def get(self, request):
+        return Response(get_chunk_cache().stats())
@@ -28,7 +28,16 @@ class SaveDownloadedAt(APIView):
                 return Response("Song not found", status=status.HTTP_404_NOT_FOUND)
 
             data = {"user": user, "song": song, "downloaded_at": datetime.now()}
-            downloaded_at = DownloadedAt.create(data)
+            try:
+                DownloadedAt.create(data)
+            except ValueError as e:
+                return Response(
+                    f"Error saving downloadedAt: {e}",
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+
+            # Only counted once the download is recorded
+            Song.incrementDownloadCount(song.id)
             return Response("Saved downloadedAt", status=status.HTTP_201_CREATED)
         except Exception as e:
             return Response(
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from apps.jobs.worker import run_workers
+
+
+class Command(BaseCommand):
+    help = "Run background jobs (post-upload media processing...) from the queue"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=None,
+            help="Worker threads (default JOB_WORKERS)",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit once no job is due instead of waiting for new ones",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            run_workers(count=options["workers"], once=options["once"])
+        except KeyboardInterrupt:
+            self.stdout.write("Stopping workers")
+            return
+        self.stdout.write(self.style.SUCCESS("Job queue drained"))
@@ -0,0 +1,138 @@
+from datetime import datetime, timedelta
+from django.conf import settings
+from mongoengine import (
+    Document,
+    StringField,
+    DictField,
+    IntField,
+    DateTimeField,
+)
+from pymongo import ReturnDocument
+
+
+class Job(Document):
+    """
+    Background work run by the `manage.py run_jobs` workers.
+
+    queued -> running -> done, or back to queued with a growing delay until
+    max_attempts is reached, then failed. A running job whose worker died
+    is claimed again once locked_until has passed.
+    """
+
+    kind = StringField(required=True)
+    payload = DictField()
+    status = StringField(
+        default="queued", choices=("queued", "running", "done", "failed")
+    )
+    attempts = IntField(default=0)
+    max_attempts = IntField(default=3)
+    run_at = DateTimeField(default=datetime.utcnow)
+    locked_until = DateTimeField()
+    worker = StringField()
+    last_error = StringField()
+    created_at = DateTimeField(default=datetime.utcnow)
+    finished_at = DateTimeField()
+
+    meta = {
+        "collection": "jobs",
+        "indexes": [("status", "run_at"), ("status", "locked_until")],
+    }
+
+    @staticmethod
+    def enqueue(kind, payload=None, max_attempts=None):
+        job = Job(
+            kind=kind,
+            payload=payload or {},
+            max_attempts=max_attempts or settings.JOB_MAX_ATTEMPTS,
+        )
+        job.save()
+        return job
+
+    @staticmethod
+    def enqueueMany(kind, payloads, max_attempts=None):
+        jobs = [
+            Job(
+                kind=kind,
+                payload=payload,
+                max_attempts=max_attempts or settings.JOB_MAX_ATTEMPTS,
+            ).to_mongo()
+            for payload in payloads
+        ]
+        if jobs:
+            Job._get_collection().insert_many(jobs)
+        return len(jobs)
+
+    @staticmethod
+    def claim(worker, timeout):
+        """Take the oldest due job, hidden from other workers for timeout seconds"""
+        now = datetime.utcnow()
+        row = Job._get_collection().find_one_and_update(
+            {
+                "$or": [
+                    {"status": "queued", "run_at": {"$lte": now}},
+                    {"status": "running", "locked_until": {"$lte": now}},
+                ]
+            },
+            {
+                "$set": {
+                    "status": "running",
+                    "worker": worker,
+                    "locked_until": now + timedelta(seconds=timeout),
+                },
+                "$inc": {"attempts": 1},
+            },
+            sort=[("run_at", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+        return Job._from_son(row) if row else None
+
+    @staticmethod
+    def _finish(job, update):
+        # Matching the attempt keeps a worker whose claim expired from
+        # overwriting the outcome of the worker that took the job over
+        return (
+            Job._get_collection()
+            .update_one(
+                {"_id": job.id, "status": "running", "attempts": job.attempts},
+                {"$set": update},
+            )
+            .modified_count
+            > 0
+        )
+
+    @staticmethod
+    def complete(job):
+        return Job._finish(
+            job,
+            {"status": "done", "locked_until": None, "finished_at": datetime.utcnow()},
+        )
+
+    @staticmethod
+    def fail(job, error):
+        """
+        Schedule a retry, or mark the job failed. True only when this call
+        marked it failed, not when another worker had taken it over.
+        """
+        now = datetime.utcnow()
+        if job.attempts >= job.max_attempts:
+            return Job._finish(
+                job,
+                {
+                    "status": "failed",
+                    "locked_until": None,
+                    "last_error": error,
+                    "finished_at": now,
+                },
+            )
+
+        delay = settings.JOB_RETRY_DELAY * 2 ** (job.attempts - 1)
+        Job._finish(
+            job,
+            {
+                "status": "queued",
+                "locked_until": None,
+                "last_error": error,
+                "run_at": now + timedelta(seconds=delay),
+            },
+        )
+        return False
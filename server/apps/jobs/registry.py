@@ -0,0 +1,28 @@
+# Job kind -> (handler(payload), on_failure(payload, error) or None)
+handlers = {}
+# Functions enqueueing work whose job was never written
+recoveries = []
+
+
+def job_handler(kind, on_failure=None):
+    """
+    Register the decorated function to run jobs of kind. on_failure runs
+    once the job failed its last attempt. Handlers live in a jobs.py module
+    of their app, which the workers import on start.
+    """
+
+    def register(handler):
+        handlers[kind] = (handler, on_failure)
+        return handler
+
+    return register
+
+
+def job_recovery(recover):
+    """
+    Register the decorated function to enqueue the jobs lost when a process
+    stopped between saving a document and enqueueing its job. The workers
+    run it on start and every JOB_RECOVERY_INTERVAL seconds.
+    """
+    recoveries.append(recover)
+    return recover
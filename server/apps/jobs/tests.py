@@ -0,0 +1,59 @@
+from datetime import datetime
+from unittest import mock
+from django.test import override_settings
+from utils.testing import MongoTestCase
+from .models import Job
+from .registry import handlers
+from .worker import run_job
+
+
+class JobQueueTests(MongoTestCase):
+    def test_claim_takes_each_due_job_once(self):
+        first = Job.enqueue("test.kind", {"n": 1})
+        Job.enqueue("test.kind", {"n": 2})
+
+        claimed = Job.claim("worker-1", 60)
+        self.assertEqual(claimed.id, first.id)
+        self.assertEqual((claimed.status, claimed.attempts), ("running", 1))
+        self.assertEqual(Job.claim("worker-2", 60).payload, {"n": 2})
+        self.assertIsNone(Job.claim("worker-3", 60))
+
+    def test_job_is_claimed_again_after_the_visibility_timeout(self):
+        Job.enqueue("test.kind")
+        stale = Job.claim("worker-1", 0)
+
+        taken_over = Job.claim("worker-2", 60)
+        self.assertEqual(taken_over.id, stale.id)
+        self.assertEqual(taken_over.attempts, 2)
+
+        # The first worker can no longer decide the outcome
+        self.assertFalse(Job.complete(stale))
+        self.assertTrue(Job.complete(taken_over))
+        self.assertEqual(Job.objects.get(id=stale.id).status, "done")
+
+    @override_settings(JOB_RETRY_DELAY=3600)
+    def test_failed_attempt_is_retried_later(self):
+        Job.enqueue("test.kind", max_attempts=2)
+
+        job = Job.claim("worker-1", 60)
+        self.assertFalse(Job.fail(job, "boom"))
+        job.reload()
+        self.assertEqual((job.status, job.last_error), ("queued", "boom"))
+        self.assertGreater(job.run_at, datetime.utcnow())
+        self.assertIsNone(Job.claim("worker-1", 60))
+
+    @override_settings(JOB_RETRY_DELAY=0)
+    def test_last_failed_attempt_runs_the_failure_hook(self):
+        on_failure = mock.Mock()
+        handler = mock.Mock(side_effect=ValueError("boom"))
+        Job.enqueue("test.kind", {"n": 1}, max_attempts=2)
+
+        with mock.patch.dict(handlers, {"test.kind": (handler, on_failure)}):
+            self.assertFalse(run_job(Job.claim("worker-1", 60)))
+            on_failure.assert_not_called()
+            self.assertFalse(run_job(Job.claim("worker-1", 60)))
+
+        self.assertEqual(handler.call_count, 2)
+        on_failure.assert_called_once()
+        job = Job.objects.get()
+        self.assertEqual((job.status, job.attempts), ("failed", 2))
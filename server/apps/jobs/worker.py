@@ -0,0 +1,85 @@
+import os
+import socket
+import threading
+import time
+from django.conf import settings
+from django.utils.module_loading import autodiscover_modules
+from .models import Job
+from .registry import handlers, recoveries
+
+
+def run_job(job):
+    handler, on_failure = handlers.get(job.kind, (None, None))
+    try:
+        if handler is None:
+            raise LookupError(f"No handler registered for {job.kind}")
+        if job.attempts > job.max_attempts:
+            # Claimed again after its workers kept dying mid-run
+            raise RuntimeError("Job timed out on every attempt")
+        handler(job.payload)
+    except Exception as e:
+        print(f"[Job {job.id}] {job.kind} attempt {job.attempts} failed: {e}")
+        # A worker whose claim expired meanwhile does not run the hook, the
+        # one that took the job over decides its outcome
+        if Job.fail(job, str(e)) and on_failure:
+            on_failure(job.payload, e)
+        return False
+
+    Job.complete(job)
+    return True
+
+
+def run_recoveries():
+    for recover in recoveries:
+        try:
+            recover()
+        except Exception as e:
+            print(f"[Jobs] {recover.__name__} failed: {e}")
+
+
+def work(name, stop, timeout, poll_interval, once):
+    """Claim and run jobs until stop is set, or the queue is empty with once"""
+    while not stop.is_set():
+        job = Job.claim(name, timeout)
+        if job is None:
+            if once:
+                return
+            stop.wait(poll_interval)
+            continue
+        run_job(job)
+
+
+def run_workers(count=None, timeout=None, poll_interval=None, once=False, stop=None):
+    autodiscover_modules("jobs")
+    stop = stop or threading.Event()
+    run_recoveries()
+    prefix = f"{socket.gethostname()}:{os.getpid()}"
+
+    threads = [
+        threading.Thread(
+            target=work,
+            name=f"job-worker-{index}",
+            args=(
+                f"{prefix}:{index}",
+                stop,
+                timeout or settings.JOB_VISIBILITY_TIMEOUT,
+                poll_interval or settings.JOB_POLL_INTERVAL,
+                once,
+            ),
+            daemon=True,
+        )
+        for index in range(count or settings.JOB_WORKERS)
+    ]
+    for thread in threads:
+        thread.start()
+    next_recovery = time.monotonic() + settings.JOB_RECOVERY_INTERVAL
+    try:
+        for thread in threads:
+            # Joining with a timeout keeps Ctrl+C responsive
+            while thread.is_alive():
+                thread.join(1)
+                if not once and time.monotonic() >= next_recovery:
+                    run_recoveries()
+                    next_recovery = time.monotonic() + settings.JOB_RECOVERY_INTERVAL
+    finally:
+        stop.set()
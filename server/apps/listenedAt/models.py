@@ -8,7 +8,10 @@ class ListenedAt(Document):
     song = ReferenceField(Song)
     listened_at = DateTimeField()
 
-    meta = {"collection": "listened_at"}
+    meta = {
+        "collection": "listened_at",
+        "indexes": ["song", ("-listened_at", "-id")],
+    }
 
     @staticmethod
     def create(data):
@@ -18,3 +21,15 @@ class ListenedAt(Document):
             return listenedAt
         except ValueError as e:
             return ValueError({"Error: ", str(e)})
+
+    @staticmethod
+    def countBySongs(song_ids):
+        # One $group over the whole page instead of a count() per song
+        counts = {str(song_id): 0 for song_id in song_ids}
+        if not counts:
+            return counts
+
+        pipeline = [{"$group": {"_id": "$song", "count": {"$sum": 1}}}]
+        for row in ListenedAt.objects(song__in=list(song_ids)).aggregate(pipeline):
+            counts[str(row["_id"])] = row["count"]
+        return counts
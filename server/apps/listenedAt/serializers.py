@@ -6,6 +6,15 @@ from apps.users.serializers import UserDetailSerializer
 from bson import ObjectId
 from mongoengine.errors import DoesNotExist
 from datetime import datetime
+from utils.reference_loader import get_reference_loader
+
+
+class ListenedAtListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        records = get_reference_loader(self.context).load(
+            list(data), "user", "song", "song.user", "song.genre"
+        )
+        return super().to_representation(records)
 
 
 class ListenedAtSerializer(serializers.Serializer):
@@ -16,6 +25,9 @@ class ListenedAtSerializer(serializers.Serializer):
     user = serializers.SerializerMethodField()
     listened_at = serializers.DateTimeField()
 
+    class Meta:
+        list_serializer_class = ListenedAtListSerializer
+
     def get_song(self, obj):
         """Get serialized song data"""
         if not obj.song:
@@ -27,6 +39,6 @@ class ListenedAtSerializer(serializers.Serializer):
         try:
             if not obj.user:
                 return None
-            return UserDetailSerializer(obj.user).data
+            return UserDetailSerializer(obj.user, context=self.context).data
         except DoesNotExist:
             return None
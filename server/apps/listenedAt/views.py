@@ -2,23 +2,102 @@ from rest_framework.views import APIView
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
+from rest_framework.exceptions import NotFound, ValidationError
+from django.http import StreamingHttpResponse
+from django.utils.dateparse import parse_date, parse_datetime
 from .serializers import ListenedAtSerializer
 from .models import ListenedAt
 from apps.songs.models import Song
-from datetime import datetime
+from datetime import datetime, time
+from bson import ObjectId
+from utils.cursor_pagination import MongoCursorPagination
+import json
+
+EXPORT_BATCH_SIZE = 1000
+
+
+class ListenedAtPagination(MongoCursorPagination):
+    ordering_field = "listened_at"
 
 
 class GetAllListenedAtView(APIView):
     permission_classes = [AllowAny]
 
+    def parse_datetime_param(self, request, name):
+        value = request.query_params.get(name, "").strip()
+        if not value:
+            return None
+        parsed = parse_datetime(value)
+        if parsed is None:
+            parsed_date = parse_date(value)
+            if parsed_date is not None:
+                parsed = datetime.combine(parsed_date, time.min)
+        if parsed is None:
+            raise ValidationError({name: "Expected an ISO 8601 date or datetime"})
+        return parsed
+
+    def filter_records(self, request):
+        filters = {}
+
+        listened_from = self.parse_datetime_param(request, "from")
+        if listened_from:
+            filters["listened_at__gte"] = listened_from
+
+        listened_to = self.parse_datetime_param(request, "to")
+        if listened_to:
+            filters["listened_at__lt"] = listened_to
+
+        user_id = request.query_params.get("user_id", "").strip()
+        if user_id:
+            if not ObjectId.is_valid(user_id):
+                raise ValidationError({"user_id": "Invalid user_id format"})
+            filters["user"] = ObjectId(user_id)
+
+        return ListenedAt.objects(**filters)
+
+    def export_ndjson(self, records):
+        # Raw documents from a server-side cursor, one JSON object per line
+        cursor = (
+            records.order_by("listened_at", "id")
+            .no_cache()
+            .batch_size(EXPORT_BATCH_SIZE)
+            .as_pymongo()
+        )
+
+        for record in cursor:
+            listened_at = record.get("listened_at")
+            yield json.dumps(
+                {
+                    "id": str(record["_id"]),
+                    "user": str(record["user"]) if record.get("user") else None,
+                    "song": str(record["song"]) if record.get("song") else None,
+                    "listened_at": listened_at.isoformat() if listened_at else None,
+                }
+            ) + "\n"
+
     def get(self, request):
         try:
-            listened_at_records = ListenedAt.objects.all()
+            listened_at_records = self.filter_records(request)
 
-            serializer = ListenedAtSerializer(listened_at_records, many=True)
+            if request.query_params.get("export") == "ndjson":
+                response = StreamingHttpResponse(
+                    self.export_ndjson(listened_at_records),
+                    content_type="application/x-ndjson",
+                )
+                response["Content-Disposition"] = (
+                    'attachment; filename="listened_at.ndjson"'
+                )
+                return response
 
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            paginator = ListenedAtPagination()
+            page = paginator.paginate_queryset(listened_at_records, request, view=self)
 
+            serializer = ListenedAtSerializer(page, many=True)
+
+            return paginator.get_paginated_response(serializer.data)
+
+        except (NotFound, ValidationError):
+            raise
         except Exception as e:
             return Response(
                 {"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR
@@ -47,6 +126,13 @@ class SaveListenedAtView(APIView):
 
             data = {"user": user, "song": song, "listened_at": datetime.now()}
             listened_at = ListenedAt.create(data)
+            if isinstance(listened_at, ValueError):
+                return Response(
+                    f"Error saving ListenedAt: {listened_at}",
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+
+            Song.incrementPlayCount(song.id)
             return Response("Saved listenedAt", status=status.HTTP_201_CREATED)
         except Exception as e:
             return Response(
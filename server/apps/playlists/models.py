@@ -14,6 +14,16 @@ from mongoengine import (
 from apps.users.models import User
 from apps.songs.models import Song
 from datetime import datetime
+from bson import ObjectId
+from mongoengine.fields import GridFSProxy
+from utils.blob_storage import (
+    BlobRef,
+    GridFSBackend,
+    get_backend,
+    media_refs,
+    release_blobs,
+)
+from utils.search_text import search_terms, query_terms, relevance
 
 
 class SongsOfPlaylist(EmbeddedDocument):
@@ -25,13 +35,37 @@ class Playlist(Document):
     user = ReferenceField(User, required=True)
     name = StringField(required=True)
     cover = FileField(required=False)
+    cover_blob = EmbeddedDocumentField(BlobRef)
     is_favorite = BooleanField(default=False)
     desc = StringField()
     songs = ListField(EmbeddedDocumentField(SongsOfPlaylist))
     created_at = DateTimeField(default=datetime.now)
     updated_at = DateTimeField(default=datetime.now)
-
-    meta = {"collection": "playlists"}
+    search_terms = ListField(StringField())
+
+    meta = {"collection": "playlists", "indexes": ["search_terms"]}
+
+    def clean(self):
+        self.search_terms = search_terms(self.name)
+
+    def setCover(self, cover_file):
+        """
+        Replace the cover, written to the configured storage backend. Returns
+        the blobs of the previous cover, to release once the playlist is saved.
+        """
+        content_type = getattr(cover_file, "content_type", "image/jpeg")
+        filename = getattr(cover_file, "name", "cover")
+        replaced = media_refs(self, "cover")
+
+        backend = get_backend()
+        ref = backend.save(cover_file, content_type=content_type, filename=filename)
+        if backend.name == GridFSBackend.name:
+            self.cover = GridFSProxy(grid_id=ObjectId(ref.key))
+            self.cover_blob = None
+        else:
+            self.cover = None
+            self.cover_blob = ref
+        return replaced
 
     @staticmethod
     def create(data):
@@ -48,15 +82,12 @@ class Playlist(Document):
 
             cover_file = data.get("cover")
             if cover_file:
-                playlist.cover.put(
-                    cover_file,
-                    content_type=getattr(cover_file, "content_type", "image/jpeg"),
-                    filename=getattr(cover_file, "name", "cover"),
-                )
+                playlist.setCover(cover_file)
 
             playlist.save()
             return playlist
         except (ValidationError, ValueError) as e:
+            release_blobs(media_refs(playlist, "cover"))
             return ValueError({"Error: ", str(e)})
 
     @staticmethod
@@ -76,12 +107,66 @@ class Playlist(Document):
     @staticmethod
     def search(query, user_id=None):
         try:
+            filters = {}
             if user_id:
-                return Playlist.objects.filter(name__icontains=query, user=user_id)
-            return Playlist.objects.filter(name__icontains=query)
+                filters["user"] = user_id
+
+            terms = query_terms(query)
+            if terms:
+                filters["search_terms__all"] = terms
+            elif query and query.strip():
+                return []
+
+            playlists = list(Playlist.objects.filter(**filters))
+            playlists.sort(
+                key=lambda playlist: relevance(playlist.name, query), reverse=True
+            )
+            return playlists
         except DoesNotExist:
             return None
 
+    @staticmethod
+    def searchRankedByListens(query, limit):
+        """Non-favorite, non-empty playlists matching query, by total song plays"""
+        terms = query_terms(query)
+        if not terms:
+            return []
+
+        pipeline = [
+            {
+                # Joined on _id, then only the play counts of songs that are
+                # not deleted are brought in (localField with a pipeline
+                # needs MongoDB 5.0)
+                "$lookup": {
+                    "from": Song._get_collection_name(),
+                    "localField": "songs.song",
+                    "foreignField": "_id",
+                    "pipeline": [
+                        {"$match": {"deleted_at": None}},
+                        {"$project": {"_id": 0, "play_count": 1}},
+                    ],
+                    "as": "song_docs",
+                }
+            },
+            {"$project": {"total_listen": {"$sum": "$song_docs.play_count"}}},
+            {"$sort": {"total_listen": -1, "_id": 1}},
+            {"$limit": limit},
+        ]
+        rows = list(
+            Playlist.objects(
+                search_terms__all=terms,
+                is_favorite__ne=True,
+                __raw__={"songs.0": {"$exists": True}},
+            ).aggregate(pipeline)
+        )
+
+        playlists = Playlist.objects.in_bulk([row["_id"] for row in rows])
+        return [
+            (playlists[row["_id"]], row["total_listen"])
+            for row in rows
+            if row["_id"] in playlists
+        ]
+
     @staticmethod
     def addSongToPlayList(playlist_id, song_id):
         try:
@@ -116,16 +201,19 @@ class Playlist(Document):
     @staticmethod
     def delete(playlist_id):
         try:
-            playlist = Playlist.objects(id=playlist_id)
+            playlist = Playlist.objects(id=playlist_id).first()
             if not playlist:
                 return False
-            playlist.delete()
+            Playlist.objects(id=playlist.id).delete()
+            release_blobs(media_refs(playlist, "cover"))
             return True
         except DoesNotExist:
             return False
 
     @staticmethod
     def update(playlist_id, data):
+        # Blobs of a new cover, released if the playlist cannot be saved
+        written = []
         try:
             playlist = Playlist.findById(playlist_id)
             if not playlist:
@@ -143,23 +231,20 @@ class Playlist(Document):
             playlist.desc = data.get("desc")
             cover_file = data.get("cover")
 
+            replaced = []
             if cover_file:
-                # Delete the existing file before adding a new one
-                if hasattr(playlist.cover, "delete"):
-                    playlist.cover.delete()
-
-                playlist.cover.put(
-                    cover_file,
-                    content_type=getattr(cover_file, "content_type", "image/jpeg"),
-                    filename=getattr(cover_file, "name", "cover"),
-                )
+                replaced = playlist.setCover(cover_file)
+                written = media_refs(playlist, "cover")
             playlist.updated_at = datetime.now()
 
             playlist.save()
+            release_blobs(replaced)
             return playlist
         except DoesNotExist:
             return None, "Playlist does not exist"
         except ValidationError as e:
+            release_blobs(written)
             return None, f"Validation error: {str(e)}"
         except Exception as e:
+            release_blobs(written)
             return None, f"Unexpected error: {str(e)}"
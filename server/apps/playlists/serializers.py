@@ -2,6 +2,28 @@ import base64
 from mongoengine import DoesNotExist
 from rest_framework import serializers
 from apps.users.serializers import UserCreationSerializer
+from utils.blob_storage import get_backend
+from utils.media_urls import media_url, media_version, wants_inline_images
+from utils.reference_loader import get_reference_loader
+
+PLAYLIST_REFERENCES = ("user", "songs.song", "songs.song.user", "songs.song.genre")
+
+
+def _playlist_song_ids(playlists):
+    song_ids = []
+    for playlist in playlists:
+        for entry in playlist.songs:
+            # Read the raw reference so a dangling song does not raise here
+            ref = entry._data.get("song")
+            if ref is not None:
+                song_ids.append(getattr(ref, "id", ref))
+    return song_ids
+
+
+def _prefetch_listened_at_counts(context, playlists):
+    from apps.songs.serializers import prefetch_listened_at_counts
+
+    prefetch_listened_at_counts(context, _playlist_song_ids(playlists))
 
 
 class SongsOfPlaylistSerializer(serializers.Serializer):
@@ -18,6 +40,15 @@ class SongsOfPlaylistSerializer(serializers.Serializer):
             return None
 
 
+class PlaylistListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        playlists = get_reference_loader(self.context).load(
+            list(data), *PLAYLIST_REFERENCES
+        )
+        _prefetch_listened_at_counts(self.context, playlists)
+        return super().to_representation(playlists)
+
+
 class PlaylistSerializer(serializers.Serializer):
     id = serializers.CharField(read_only=True)
     user = serializers.SerializerMethodField()
@@ -29,6 +60,14 @@ class PlaylistSerializer(serializers.Serializer):
     created_at = serializers.DateTimeField()
     updated_at = serializers.DateTimeField()
 
+    class Meta:
+        list_serializer_class = PlaylistListSerializer
+
+    def to_representation(self, instance):
+        get_reference_loader(self.context).load([instance], *PLAYLIST_REFERENCES)
+        _prefetch_listened_at_counts(self.context, [instance])
+        return super().to_representation(instance)
+
     def get_user(self, obj):
         try:
             if not obj.user:
@@ -38,7 +77,18 @@ class PlaylistSerializer(serializers.Serializer):
             return None
 
     def get_cover(self, obj):
+        if not wants_inline_images(self.context):
+            version = media_version(obj, "cover")
+            if not version:
+                return None
+            return media_url(self.context, f"/api/playlists/{obj.id}/cover/", version)
         try:
+            if obj.cover_blob:
+                with get_backend(obj.cover_blob.backend).open(obj.cover_blob) as blob:
+                    content = blob.read()
+                content_type = obj.cover_blob.content_type or "image/jpeg"
+                base64_data = base64.b64encode(content).decode("utf-8")
+                return f"data:{content_type};base64,{base64_data}"
             if obj.cover and hasattr(obj.cover, "grid_id"):
                 content = obj.cover.read()
                 content_type = getattr(obj.cover, "content_type", "image/jpeg")
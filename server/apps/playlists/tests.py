@@ -1,3 +1,158 @@
-from django.test import TestCase
+import io
+import tempfile
+import threading
+from unittest import mock
+from gridfs import GridFS
+from mongoengine.connection import get_db
+from apps.users.models import User
+from utils.blob_storage import (
+    FileSystemBackend,
+    GridFSBackend,
+    StoredBlob,
+    media_refs,
+    release_blobs,
+    store_uploads,
+)
+from utils.testing import MongoTestCase
+from .models import Playlist
 
-# Create your tests here.
+
+def upload(content):
+    return io.BytesIO(content)
+
+
+class BrokenUpload:
+    """Upload whose body cannot be read, e.g. a client that went away"""
+
+    def read(self, size=-1):
+        raise OSError("connection reset")
+
+
+class BlobReferenceTests(MongoTestCase):
+    def setUp(self):
+        self.backend = GridFSBackend()
+        self.fs = GridFS(get_db())
+
+    def refs(self, ref):
+        return StoredBlob.objects.get(backend=ref.backend, key=ref.key).refs
+
+    def test_same_content_is_stored_once(self):
+        first = self.backend.save(upload(b"cover"))
+        second = self.backend.save(upload(b"cover"))
+
+        self.assertEqual(first.key, second.key)
+        self.assertEqual(self.refs(first), 2)
+        self.assertEqual(get_db()["fs.files"].count_documents({}), 1)
+
+    def test_different_content_is_stored_apart(self):
+        first = self.backend.save(upload(b"cover"))
+        second = self.backend.save(upload(b"other cover"))
+
+        self.assertNotEqual(first.key, second.key)
+        self.assertEqual(self.refs(first), 1)
+        self.assertEqual(self.refs(second), 1)
+
+    def test_content_is_removed_with_its_last_reference(self):
+        first = self.backend.save(upload(b"cover"))
+        second = self.backend.save(upload(b"cover"))
+
+        release_blobs([first])
+        self.assertEqual(self.refs(second), 1)
+        self.assertTrue(self.fs.exists(self.backend.open(second)._id))
+
+        release_blobs([second])
+        self.assertFalse(StoredBlob.objects(key=second.key))
+        self.assertEqual(get_db()["fs.files"].count_documents({}), 0)
+
+    def test_failed_write_removes_the_other_uploads(self):
+        data = {
+            "audio": upload(b"audio"),
+            "video": BrokenUpload(),
+            "cover": upload(b"cover"),
+        }
+
+        with self.assertRaises(OSError):
+            store_uploads(data, ("audio", "video", "cover"))
+
+        self.assertEqual(StoredBlob.objects.count(), 0)
+        self.assertEqual(get_db()["fs.files"].count_documents({}), 0)
+
+
+class FileSystemBlobTests(MongoTestCase):
+    def setUp(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        self.backend = FileSystemBackend(root.name)
+
+    def test_upload_during_removal_of_the_same_content_is_kept(self):
+        ref = self.backend.save(upload(b"cover"))
+        removing = threading.Event()
+        resume = threading.Event()
+        remove = FileSystemBackend.remove
+
+        def paused_remove(backend, key):
+            removing.set()
+            resume.wait(5)
+            remove(backend, key)
+
+        uploaded = []
+        with mock.patch.object(FileSystemBackend, "remove", paused_remove):
+            deleter = threading.Thread(target=self.backend.delete, args=(ref,))
+            deleter.start()
+            self.assertTrue(removing.wait(5))
+            uploader = threading.Thread(
+                target=lambda: uploaded.append(self.backend.save(upload(b"cover")))
+            )
+            uploader.start()
+            # The upload waits for the removal instead of reusing the file
+            uploader.join(0.2)
+            self.assertTrue(uploader.is_alive())
+            resume.set()
+            deleter.join()
+            uploader.join()
+
+        (new,) = uploaded
+        self.assertEqual(new.key, ref.key)
+        self.assertEqual(StoredBlob.objects.get(key=new.key).refs, 1)
+        with self.backend.open(new) as stored:
+            self.assertEqual(stored.read(), b"cover")
+
+
+class PlaylistCoverTests(MongoTestCase):
+    def setUp(self):
+        self.user = User(name="A", email="a@example.com", password="x").save()
+
+    def create(self, cover):
+        return Playlist.create({"user": self.user, "name": "P", "cover": upload(cover)})
+
+    def update(self, playlist, **data):
+        return Playlist.update(playlist.id, {"user": self.user, "name": "P", **data})
+
+    def test_replacing_the_cover_releases_the_old_one(self):
+        playlist = self.create(b"old cover")
+        (old,) = media_refs(playlist, "cover")
+
+        playlist = self.update(playlist, cover=upload(b"new cover"))
+
+        self.assertFalse(StoredBlob.objects(key=old.key))
+        (new,) = media_refs(playlist, "cover")
+        self.assertEqual(StoredBlob.objects.get(key=new.key).refs, 1)
+
+    def test_replacing_a_shared_cover_keeps_it_for_the_others(self):
+        playlist = self.create(b"shared cover")
+        other = self.create(b"shared cover")
+        (shared,) = media_refs(other, "cover")
+
+        self.update(playlist, cover=upload(b"new cover"))
+
+        self.assertEqual(StoredBlob.objects.get(key=shared.key).refs, 1)
+
+    def test_cover_of_an_invalid_update_is_released(self):
+        playlist = self.create(b"old cover")
+        (old,) = media_refs(playlist, "cover")
+
+        result, error = self.update(playlist, desc=123, cover=upload(b"new cover"))
+
+        self.assertIsNone(result)
+        self.assertIn("Validation error", error)
+        self.assertEqual(list(StoredBlob.objects.scalar("key")), [old.key])
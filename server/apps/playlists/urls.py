@@ -10,6 +10,7 @@ from apps.playlists.views import (
     GetPlaylistsByUserIdView,
     FavoritePlaylistByUserIdView,
     SearchView,
+    PlaylistCoverView,
 )
 
 urlpatterns = [
@@ -33,4 +34,6 @@ urlpatterns = [
     ),
     path("favorite/", FavoritePlaylistByUserIdView.as_view(),
          name="favorite-by-user"),
+    path("<str:playlist_id>/cover/", PlaylistCoverView.as_view(),
+         name="playlist-cover"),
 ]
@@ -1,11 +1,12 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework import status
 from rest_framework.parsers import FormParser, MultiPartParser
 from .models import Playlist, SongsOfPlaylist
 from apps.songs.models import Song
 from .serializers import PlaylistSerializer
+from apps.songs.media import describe_media, serve_media
 from bson import ObjectId
 from datetime import datetime
 
@@ -21,7 +22,9 @@ class SearchView(APIView):
         if not playlists:
             return Response([], status=status.HTTP_200_OK)
 
-        serializer = PlaylistSerializer(playlists, many=True)
+        serializer = PlaylistSerializer(
+            playlists, many=True, context={"request": request}
+        )
         return Response(serializer.data, status=status.HTTP_200_OK)
 
 
@@ -279,3 +282,31 @@ class FavoritePlaylistByUserIdView(APIView):
 
         serializer = PlaylistSerializer(favorite_playlist, context={"request": request})
         return Response(serializer.data, status=status.HTTP_200_OK)
+
+
+class PlaylistCoverView(APIView):
+    """Cover bytes, linked from PlaylistSerializer with a ?v=<file id> version"""
+
+    permission_classes = [AllowAny]
+
+    def get(self, request, playlist_id):
+        try:
+            playlist = None
+            if ObjectId.is_valid(playlist_id):
+                playlist = Playlist.findById(playlist_id)
+            if not playlist:
+                return Response(
+                    {"error": "Playlist not found"}, status=status.HTTP_404_NOT_FOUND
+                )
+
+            descriptor = describe_media(playlist.to_mongo(), "cover")
+            if not descriptor.media_file:
+                return Response(
+                    {"error": "Cover image not found"}, status=status.HTTP_404_NOT_FOUND
+                )
+            return serve_media(request, descriptor, "image/jpeg")
+
+        except Exception as e:
+            return Response(
+                {"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
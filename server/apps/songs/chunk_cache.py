@@ -0,0 +1,97 @@
+import threading
+from collections import OrderedDict
+from django.conf import settings
+
+# Content types whose chunks are kept. Songs are replayed and covers shown
+# on every page, while one long video would push all of them out
+CACHED_CONTENT_TYPES = ("audio/", "image/")
+
+
+class ChunkCache:
+    """
+    LRU cache of fs.chunks data keyed by (file_id, n), bounded by the total
+    number of bytes held rather than by entry count.
+
+    Shared by every sync view thread and the async consumer of a process, so
+    each operation takes a lock for the few dictionary operations it does.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            return data
+
+    def contains(self, key):
+        """Membership test that neither counts as a hit nor refreshes recency"""
+        with self._lock:
+            return key in self._entries
+
+    def put(self, key, data):
+        """Add a chunk that had to be read from MongoDB (counted as a miss)"""
+        with self._lock:
+            self.misses += 1
+            if len(data) > self.max_bytes:
+                return
+
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous)
+
+            self._entries[key] = data
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+_chunk_cache = None
+_chunk_cache_lock = threading.Lock()
+
+
+def chunk_cache_for(content_type):
+    """The process' cache if chunks of content_type are kept in it, else None"""
+    if content_type and content_type.startswith(CACHED_CONTENT_TYPES):
+        return get_chunk_cache()
+    return None
+
+
+def get_chunk_cache():
+    """Cache shared by the process, sized from MEDIA_CHUNK_CACHE_MB on first use"""
+    global _chunk_cache
+
+    if _chunk_cache is None:
+        with _chunk_cache_lock:
+            if _chunk_cache is None:
+                _chunk_cache = ChunkCache(settings.MEDIA_CHUNK_CACHE_MB * 1024 * 1024)
+    return _chunk_cache
@@ -0,0 +1,174 @@
+import asyncio
+import io
+import json
+from functools import partial
+from channels.exceptions import StopConsumer
+from channels.generic.http import AsyncHttpConsumer
+from corsheaders.conf import conf
+from django.core.handlers.asgi import ASGIRequest
+from .media import (
+    aget_media_descriptor,
+    aiter_file_range,
+    aiter_range,
+    prepare_media_response,
+)
+
+
+class MediaStreamConsumer(AsyncHttpConsumer):
+    """
+    Async counterpart of SongFileView / SongVideoView, mounted in server/asgi.py.
+
+    MongoDB is read through motor and the body is sent chunk by chunk from
+    the event loop, so a listener does not hold a worker thread for the
+    length of the song. The response runs in a task cancelled when the
+    client disconnects, instead of reading the file to the end.
+    """
+
+    def __init__(self, field, default_content_type, extension, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.field = field
+        self.default_content_type = default_content_type
+        self.extension = extension
+        self.headers_sent = False
+        self.response_task = None
+
+    async def http_request(self, message):
+        if "body" in message:
+            self.body.append(message["body"])
+        if not message.get("more_body"):
+            # The server sends http.disconnect once the response is over, or
+            # when the client goes away first
+            self.response_task = asyncio.ensure_future(self.handle(b"".join(self.body)))
+
+    async def http_disconnect(self, message):
+        if self.response_task:
+            self.response_task.cancel()
+            try:
+                await self.response_task
+            except asyncio.CancelledError:
+                pass
+        await self.disconnect()
+        raise StopConsumer()
+
+    async def handle(self, body):
+        request = ASGIRequest(self.scope, io.BytesIO(body))
+        try:
+            if is_preflight(request):
+                return await self.send_preflight(request)
+            if request.method not in ("GET", "HEAD"):
+                return await self.send_error(
+                    request,
+                    405,
+                    "Method not allowed",
+                    [("Allow", "GET, HEAD, OPTIONS")],
+                )
+            await self.stream(request)
+        except Exception as e:
+            print(f"Error streaming {self.field}: {e}")
+            if not self.headers_sent:
+                await self.send_error(request, 500, str(e))
+            else:
+                await self.send_body(b"")
+
+    async def stream(self, request):
+        song_id = self.scope["url_route"]["kwargs"]["song_id"]
+        descriptor = await aget_media_descriptor(song_id, self.field)
+        if not descriptor:
+            return await self.send_error(request, 404, "Song not found")
+        if not descriptor.media_file:
+            return await self.send_error(
+                request, 404, f"{self.field.capitalize()} file not found"
+            )
+
+        media_file = descriptor.media_file
+        response, segments = prepare_media_response(
+            request,
+            media_file,
+            media_file.content_type or self.default_content_type,
+            filename=f"{descriptor.title}.{self.extension}",
+        )
+        await self.start_response(request, response.status_code, response.items())
+
+        if segments is None or request.method == "HEAD":
+            return await self.send_body(b"" if response.streaming else response.content)
+
+        if descriptor.path is None:
+            read_range = partial(aiter_range, media_file)
+        else:
+            read_range = partial(aiter_file_range, descriptor.path)
+
+        for segment in segments:
+            if isinstance(segment, bytes):
+                await self.send_body(segment, more_body=True)
+                continue
+            async for data in read_range(*segment):
+                await self.send_body(data, more_body=True)
+        await self.send_body(b"")
+
+    async def start_response(self, request, status, headers):
+        headers = [
+            (name.encode("latin-1"), value.encode("latin-1")) for name, value in headers
+        ]
+        await self.send_headers(status=status, headers=headers + cors_headers(request))
+        self.headers_sent = True
+
+    async def send_error(self, request, status, message, headers=()):
+        headers = [("Content-Type", "application/json"), *headers]
+        await self.start_response(request, status, headers)
+        await self.send_body(json.dumps({"error": message}).encode())
+
+    async def send_preflight(self, request):
+        await self.start_response(request, 200, [("Content-Length", "0")])
+        await self.send_body(b"")
+
+
+def is_preflight(request):
+    return (
+        request.method == "OPTIONS"
+        and "HTTP_ACCESS_CONTROL_REQUEST_METHOD" in request.META
+    )
+
+
+def cors_headers(request):
+    """
+    The consumer bypasses Django middleware, so mirror what CorsMiddleware
+    would add for the configured origins.
+    """
+    origin = request.headers.get("Origin")
+    if not origin or not (
+        conf.CORS_ALLOW_ALL_ORIGINS or origin in conf.CORS_ALLOWED_ORIGINS
+    ):
+        return []
+
+    headers = [(b"Access-Control-Allow-Origin", origin.encode("latin-1"))]
+    if conf.CORS_ALLOW_CREDENTIALS:
+        headers.append((b"Access-Control-Allow-Credentials", b"true"))
+    if conf.CORS_EXPOSE_HEADERS:
+        headers.append(
+            (
+                b"Access-Control-Expose-Headers",
+                ", ".join(conf.CORS_EXPOSE_HEADERS).encode("latin-1"),
+            )
+        )
+    if is_preflight(request):
+        headers.append(
+            (
+                b"Access-Control-Allow-Headers",
+                ", ".join(conf.CORS_ALLOW_HEADERS).encode("latin-1"),
+            )
+        )
+        headers.append(
+            (
+                b"Access-Control-Allow-Methods",
+                ", ".join(conf.CORS_ALLOW_METHODS).encode("latin-1"),
+            )
+        )
+        if conf.CORS_PREFLIGHT_MAX_AGE:
+            headers.append(
+                (
+                    b"Access-Control-Max-Age",
+                    str(conf.CORS_PREFLIGHT_MAX_AGE).encode("latin-1"),
+                )
+            )
+    headers.append((b"Vary", b"Origin"))
+    return headers
@@ -0,0 +1,66 @@
+from gridfs import GridFS
+from mongoengine.connection import get_db
+from mutagen import File as MutagenFile, MutagenError
+from apps.jobs.models import Job
+from apps.jobs.registry import job_handler, job_recovery
+from .media import load_media_descriptor
+from .models import Song
+from .thumbnails import COVER_SIZES, get_thumbnail_descriptor
+
+# Seconds Song.create and import_songs have to enqueue the job of a song
+# they saved before it counts as lost
+ENQUEUE_GRACE = 60
+
+
+def open_media(descriptor):
+    if descriptor.path:
+        return open(descriptor.path, "rb")
+    return GridFS(get_db()).get(descriptor.media_file.id)
+
+
+def probe_duration(descriptor):
+    """Length of the audio in whole seconds, None for an unknown format"""
+    with open_media(descriptor) as media:
+        try:
+            audio = MutagenFile(media)
+        except MutagenError as e:
+            print("Error probing audio:", e)
+            return None
+
+    if audio is None or not audio.info.length:
+        return None
+    return round(audio.info.length)
+
+
+def mark_failed(payload, error):
+    Song.setProcessingStatus(payload["song_id"], "failed")
+
+
+@job_handler("songs.process_media", on_failure=mark_failed)
+def process_media(payload):
+    """Replace the client's duration by the probed one and render thumbnails"""
+    song_id = payload["song_id"]
+    Song.setProcessingStatus(song_id, "processing")
+    fields = {}
+
+    audio = load_media_descriptor(song_id, "audio")
+    if audio and audio.media_file:
+        duration = probe_duration(audio)
+        if duration:
+            fields["duration"] = duration
+
+    cover = load_media_descriptor(song_id, "cover")
+    if cover and cover.media_file:
+        for size in COVER_SIZES:
+            get_thumbnail_descriptor(cover, size, "webp")
+
+    Song.setProcessingStatus(song_id, "ready", **fields)
+
+
+@job_recovery
+def requeue_pending_songs(grace=ENQUEUE_GRACE):
+    """Enqueue songs.process_media again for pending songs that lost their job"""
+    song_ids = Song.findUnqueued(grace)
+    return Job.enqueueMany(
+        "songs.process_media", [{"song_id": song_id} for song_id in song_ids]
+    )
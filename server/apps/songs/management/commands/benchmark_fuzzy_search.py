@@ -0,0 +1,163 @@
+import random
+import statistics
+import time
+from django.core.management.base import BaseCommand
+from mongoengine.connection import get_db
+from apps.songs.models import TrigramStat
+from utils.search_text import trigrams, similarity_pipeline
+
+COLLECTION = "benchmark_fuzzy_titles"
+# Results asked for per lookup, as by the search view
+LIMIT = 20
+SYLLABLES = [
+    c + v
+    for c in ("", "b", "ch", "d", "h", "k", "l", "m", "n", "ng", "s", "t", "tr", "v")
+    for v in ("a", "e", "i", "o", "u", "ai", "em", "anh", "uong", "oi")
+]
+
+
+def random_word(rng):
+    return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(1, 3)))
+
+
+def misspell(title, rng):
+    """One random typo: a dropped, doubled or swapped character"""
+    index = rng.randrange(len(title) - 1)
+    edit = rng.choice(("drop", "double", "swap"))
+    if edit == "drop":
+        return title[:index] + title[index + 1 :]
+    if edit == "double":
+        return title[:index] + title[index] + title[index:]
+    return title[:index] + title[index + 1] + title[index] + title[index + 2 :]
+
+
+class Command(BaseCommand):
+    help = (
+        "Time fuzzy title lookups against a generated catalogue, "
+        "with and without pruning the trigrams looked up"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--titles",
+            type=int,
+            default=1_000_000,
+            help="Number of generated titles",
+        )
+        parser.add_argument(
+            "--queries",
+            type=int,
+            default=200,
+            help="Number of misspelled titles looked up",
+        )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--keep",
+            action="store_true",
+            help=f"Keep the {COLLECTION} collection and reuse it on the next run",
+        )
+
+    def generate(self, collection, count, rng, batch_size=10_000):
+        vocabulary = [random_word(rng) for _ in range(20_000)]
+        rows = []
+        for _ in range(count):
+            title = " ".join(rng.choice(vocabulary) for _ in range(rng.randint(1, 5)))
+            rows.append(
+                {"title": title, "trigrams": trigrams(title), "deleted_at": None}
+            )
+            if len(rows) >= batch_size:
+                collection.insert_many(rows, ordered=False)
+                rows = []
+        if rows:
+            collection.insert_many(rows, ordered=False)
+        collection.create_index("trigrams")
+
+    def lookup(self, collection, query, pruned):
+        started = time.perf_counter()
+        grams = trigrams(query)
+        if pruned:
+            rows = TrigramStat.similar(collection, {"deleted_at": None}, grams, LIMIT)
+        else:
+            rows = list(
+                collection.aggregate(
+                    [{"$match": {"deleted_at": None, "trigrams": {"$in": grams}}}]
+                    + similarity_pipeline(grams, LIMIT)
+                )
+            )
+        return (time.perf_counter() - started) * 1000, rows
+
+    def scored(self, collection, query, pruned, rows):
+        """Documents a lookup scored, and whether it fell back to exact trigrams"""
+        grams = trigrams(query)
+        lookups = [grams]
+        if pruned:
+            first, exact = TrigramStat.candidates(collection, grams)
+            lookups = [first]
+            if len(rows) < LIMIT and len(first) < len(exact):
+                lookups.append(exact)
+        count = sum(
+            collection.count_documents(
+                {"deleted_at": None, "trigrams": {"$in": looked_up}}
+            )
+            for looked_up in lookups
+        )
+        return count, len(lookups) > 1
+
+    def percentiles(self, values):
+        values = sorted(values)
+        p95 = values[int(len(values) * 0.95) - 1] if len(values) > 1 else values[0]
+        return statistics.median(values), p95, values[-1]
+
+    def report(self, label, timings, scored):
+        p50, p95, top = self.percentiles(timings)
+        self.stdout.write(
+            f"{label}: p50 {p50:.2f} ms, p95 {p95:.2f} ms, max {top:.2f} ms"
+        )
+        p50, p95, top = self.percentiles(scored)
+        self.stdout.write(
+            f"  documents scored: p50 {p50:.0f}, p95 {p95:.0f}, max {top:.0f}"
+        )
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        collection = get_db()[COLLECTION]
+
+        if collection.estimated_document_count() != options["titles"]:
+            collection.drop()
+            self.stdout.write(f"Generating {options['titles']} titles")
+            self.generate(collection, options["titles"], rng)
+            TrigramStat.rebuild(collection, {"deleted_at": None})
+
+        sample = collection.aggregate(
+            [{"$sample": {"size": options["queries"]}}, {"$project": {"title": 1}}]
+        )
+        queries = [
+            (row["_id"], misspell(row["title"], rng))
+            for row in sample
+            if len(row["title"]) > 2
+        ]
+
+        try:
+            for label, pruned in (("all trigrams", False), ("pruned trigrams", True)):
+                timings = []
+                scored = []
+                found = 0
+                fallbacks = 0
+                for title_id, query in queries:
+                    elapsed, rows = self.lookup(collection, query, pruned)
+                    timings.append(elapsed)
+                    found += any(row["_id"] == title_id for row in rows)
+                    count, fell_back = self.scored(collection, query, pruned, rows)
+                    scored.append(count)
+                    fallbacks += fell_back
+                self.report(label, timings, scored)
+                self.stdout.write(f"  original title found for {found}/{len(queries)}")
+                if pruned:
+                    self.stdout.write(
+                        f"  looked up again by exact trigrams for "
+                        f"{fallbacks}/{len(queries)}"
+                    )
+        finally:
+            if not options["keep"]:
+                collection.drop()
+                TrigramStat.objects(scope=COLLECTION).delete()
@@ -0,0 +1,378 @@
+import json
+import mimetypes
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
+from bson import ObjectId
+from bson.errors import InvalidId
+from django.core.management.base import BaseCommand, CommandError
+from pymongo.errors import BulkWriteError
+from apps.genre.models import Genre
+from apps.jobs.models import Job
+from apps.songs.jobs import requeue_pending_songs
+from apps.songs.models import Song
+from apps.users.models import User
+from utils.blob_storage import BlobRef, get_backend, media_fields, release_blobs
+
+# File extensions matched to Song media fields when importing a directory
+EXTENSIONS = {
+    "audio": {".mp3", ".wav", ".flac", ".ogg", ".m4a", ".aac"},
+    "video": {".mp4", ".webm", ".mov", ".mkv"},
+    "cover": {".jpg", ".jpeg", ".png", ".webp"},
+}
+
+
+def scan_directory(root):
+    """One entry per <name>.<audio|video|cover extension> group of files"""
+    groups = {}
+    for directory, _, names in os.walk(root):
+        for name in names:
+            stem, extension = os.path.splitext(name)
+            for field, extensions in EXTENSIONS.items():
+                if extension.lower() in extensions:
+                    path = os.path.join(directory, stem)
+                    groups.setdefault(path, {})[field] = os.path.join(directory, name)
+
+    for path, files in sorted(groups.items()):
+        yield {
+            "key": os.path.relpath(path, root),
+            "title": os.path.basename(path),
+            **files,
+        }
+
+
+def read_manifest(path):
+    """
+    Entries of a JSON array or JSON Lines manifest:
+    {"title", "audio", "video", "cover", "duration", "genres", "released_at"}
+    with file paths relative to the manifest.
+    """
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path) as manifest:
+        text = manifest.read()
+
+    if text.lstrip().startswith("["):
+        rows = json.loads(text)
+    else:
+        rows = [json.loads(line) for line in text.splitlines() if line.strip()]
+
+    for row in rows:
+        entry = dict(row)
+        entry["key"] = str(row.get("key") or row.get("audio"))
+        for field in Song.MEDIA_FIELDS:
+            if entry.get(field):
+                entry[field] = os.path.join(base, entry[field])
+        yield entry
+
+
+def store_file(backend, path):
+    with open(path, "rb") as content:
+        return backend.save(
+            content,
+            content_type=mimetypes.guess_type(path)[0],
+            filename=os.path.basename(path),
+        )
+
+
+class Checkpoint:
+    """
+    Progress file of JSON lines:
+    {"ref": [song_id, blob]}, appended as soon as a file of a song is stored;
+    {"songs": {entry key: song_id}}, appended before every batch insert;
+    {"released": [song_id, ...]}, appended before refs are given back.
+
+    On restart an entry counts as imported when its song exists, and the
+    blobs of songs that were never inserted are released, so a run stopped
+    at any point resumes without duplicates or blobs nothing refers to.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def resume(self):
+        """Keys of the entries imported, after releasing orphaned blobs"""
+        planned, refs, released = {}, {}, set()
+        if os.path.exists(self.path):
+            with open(self.path) as checkpoint:
+                for line in checkpoint:
+                    if not line.strip():
+                        continue
+                    row = json.loads(line)
+                    if "ref" in row:
+                        song_id, blob = row["ref"]
+                        refs.setdefault(song_id, []).append(BlobRef(**blob))
+                    planned.update(row.get("songs", {}))
+                    released.update(row.get("released", []))
+
+        ids = [ObjectId(song_id) for song_id in {*planned.values(), *refs}]
+        existing = set()
+        collection = Song._get_collection()
+        for start in range(0, len(ids), 1000):
+            rows = collection.find(
+                {"_id": {"$in": ids[start : start + 1000]}}, {"_id": 1}
+            )
+            existing.update(str(row["_id"]) for row in rows)
+
+        orphaned = [
+            song_id
+            for song_id in refs
+            if song_id not in existing and song_id not in released
+        ]
+        self.release(orphaned, [ref for song_id in orphaned for ref in refs[song_id]])
+        return {key for key, song_id in planned.items() if song_id in existing}
+
+    def record_ref(self, song_id, future):
+        """Done callback of a store_file() future"""
+        if not future.cancelled() and not future.exception():
+            ref = future.result()
+            blob = {"backend": ref.backend, "key": ref.key, "length": ref.length}
+            self.append({"ref": [str(song_id), blob]}, sync=False)
+
+    def record(self, song_ids):
+        self.append({"songs": song_ids})
+
+    def release(self, song_ids, refs):
+        # Recorded first: a crash in between leaves a blob behind rather
+        # than releasing it twice
+        if song_ids:
+            self.append({"released": [str(song_id) for song_id in song_ids]})
+            release_blobs(refs)
+
+    def append(self, row, sync=True):
+        with self.lock, open(self.path, "a") as checkpoint:
+            checkpoint.write(json.dumps(row) + "\n")
+            checkpoint.flush()
+            if sync:
+                os.fsync(checkpoint.fileno())
+
+
+class Command(BaseCommand):
+    help = "Import songs in bulk from a directory of media files or a manifest"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "source",
+            help="Directory of <name>.mp3/.mp4/.jpg... files, or a JSON/JSON Lines "
+            "manifest",
+        )
+        parser.add_argument(
+            "--user", required=True, help="Email or id of the user owning the songs"
+        )
+        parser.add_argument(
+            "--genre",
+            action="append",
+            default=[],
+            help="Genre of entries that list none (repeatable)",
+        )
+        parser.add_argument(
+            "--create-genres",
+            action="store_true",
+            help="Create genres that do not exist instead of skipping them",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=8,
+            help="Media files written at the same time",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=200,
+            help="Songs inserted per insert_many",
+        )
+        parser.add_argument(
+            "--checkpoint",
+            help="Progress file (default <source>.import-checkpoint)",
+        )
+
+    def find_user(self, value):
+        user = User.objects(email=value).first()
+        if user is None:
+            try:
+                user = User.objects(id=ObjectId(value)).first()
+            except InvalidId:
+                pass
+        if user is None:
+            raise CommandError(f"User {value} does not exist")
+        return user
+
+    def resolve_genres(self, entries, default, create):
+        """Genres of every entry by lower-cased name, loaded in one query"""
+        names = {
+            name.strip()
+            for entry in entries
+            for name in entry.get("genres") or default
+            if name.strip()
+        }
+        # The genre list is small, matching names without case is simpler
+        # over all of it than with one regex per name
+        genres = {genre.name.lower(): genre for genre in Genre.objects.only("name")}
+        missing = sorted(
+            {
+                name.lower(): name for name in names if name.lower() not in genres
+            }.values()
+        )
+        if missing and create:
+            result = Genre._get_collection().insert_many(
+                [{"name": name} for name in missing]
+            )
+            for name, genre_id in zip(missing, result.inserted_ids):
+                genres[name.lower()] = Genre(id=genre_id, name=name)
+        elif missing:
+            self.stderr.write(f"Skipping unknown genres: {', '.join(missing)}")
+        return genres
+
+    def build_song(self, song_id, entry, user, genres, default_genres, fields):
+        released_at = entry.get("released_at")
+        return Song(
+            id=song_id,
+            title=entry.get("title"),
+            genre=list(
+                {
+                    name.strip().lower(): genres[name.strip().lower()]
+                    for name in entry.get("genres") or default_genres
+                    if name.strip().lower() in genres
+                }.values()
+            ),
+            user=user,
+            # Probed from the audio by the songs.process_media job when absent
+            duration=entry.get("duration") or 0,
+            released_at=(
+                datetime.fromisoformat(released_at) if released_at else datetime.now()
+            ),
+            processing_status="pending",
+            **fields,
+        )
+
+    def import_batch(self, batch, executor, backend, checkpoint, context):
+        # Every file of the batch is written in parallel, each one recorded
+        # in the checkpoint under its song as soon as it is stored
+        song_ids = [ObjectId() for _ in batch]
+        writes = []
+        for song_id, entry in zip(song_ids, batch):
+            futures = {}
+            for field in Song.MEDIA_FIELDS:
+                if entry.get(field):
+                    futures[field] = executor.submit(store_file, backend, entry[field])
+                    futures[field].add_done_callback(
+                        partial(checkpoint.record_ref, song_id)
+                    )
+            writes.append(futures)
+
+        documents = []
+        written = {}
+        for song_id, entry, futures in zip(song_ids, batch, writes):
+            refs = {}
+            error = None
+            for field, future in futures.items():
+                try:
+                    refs[field] = future.result()
+                except Exception as e:
+                    error = error or e
+
+            try:
+                if error:
+                    raise error
+                song = self.build_song(
+                    song_id,
+                    entry,
+                    context["user"],
+                    context["genres"],
+                    context["default_genres"],
+                    media_fields(backend, refs),
+                )
+                song.validate()
+            except Exception as e:
+                checkpoint.release([song_id], refs.values())
+                self.stderr.write(f"{entry['key']}: {e}")
+                context["failed"] += 1
+                continue
+
+            documents.append(song.to_mongo())
+            written[song.id] = (entry["key"], refs)
+
+        if not documents:
+            return
+
+        checkpoint.record({key: str(song_id) for song_id, (key, _) in written.items()})
+        try:
+            Song._get_collection().insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            for error in e.details["writeErrors"]:
+                song_id = documents[error["index"]]["_id"]
+                key, refs = written.pop(song_id)
+                checkpoint.release([song_id], refs.values())
+                self.stderr.write(f"{key}: {error['errmsg']}")
+                context["failed"] += 1
+
+        Job.enqueueMany(
+            "songs.process_media", [{"song_id": str(song_id)} for song_id in written]
+        )
+        context["imported"] += len(written)
+        context["bytes"] += sum(
+            ref.length for _, refs in written.values() for ref in refs.values()
+        )
+
+    def handle(self, *args, **options):
+        source = options["source"]
+        if os.path.isdir(source):
+            entries = list(scan_directory(source))
+        elif os.path.isfile(source):
+            entries = list(read_manifest(source))
+        else:
+            raise CommandError(f"{source} is neither a directory nor a manifest")
+
+        checkpoint = Checkpoint(
+            options["checkpoint"] or f"{source.rstrip(os.sep)}.import-checkpoint"
+        )
+        imported = checkpoint.resume()
+        # Songs of an interrupted run may have been inserted without their job
+        requeued = requeue_pending_songs()
+        if requeued:
+            self.stdout.write(f"Queued processing again for {requeued} songs")
+        pending = [entry for entry in entries if entry["key"] not in imported]
+
+        context = {
+            "user": self.find_user(options["user"]),
+            "genres": self.resolve_genres(
+                pending, options["genre"], options["create_genres"]
+            ),
+            "default_genres": options["genre"],
+            "imported": 0,
+            "failed": 0,
+            "bytes": 0,
+        }
+        backend = get_backend()
+        batch_size = options["batch_size"]
+        started = time.monotonic()
+
+        with ThreadPoolExecutor(max_workers=options["workers"]) as executor:
+            for start in range(0, len(pending), batch_size):
+                self.import_batch(
+                    pending[start : start + batch_size],
+                    executor,
+                    backend,
+                    checkpoint,
+                    context,
+                )
+                elapsed = max(time.monotonic() - started, 1e-6)
+                self.stdout.write(
+                    f"{min(start + batch_size, len(pending))}/{len(pending)} entries, "
+                    f"{context['imported'] / elapsed:.1f} songs/s"
+                )
+
+        elapsed = max(time.monotonic() - started, 1e-6)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Imported {context['imported']} songs "
+                f"({len(entries) - len(pending)} already imported, "
+                f"{context['failed']} failed) in {elapsed:.1f}s: "
+                f"{context['imported'] / elapsed:.1f} songs/s, "
+                f"{context['bytes'] / elapsed / 1024 / 1024:.1f} MiB/s"
+            )
+        )
@@ -0,0 +1,135 @@
+from django.core.management.base import BaseCommand
+from gridfs import GridFS
+from gridfs.errors import NoFile
+from mongoengine.connection import get_db
+from apps.songs.models import Song
+from apps.playlists.models import Playlist
+from utils.blob_storage import BlobRef, FileSystemBackend, GridFSBackend, StoredBlob
+
+# (document, GridFS FileFields moved to <field>_blob)
+MIGRATED = [(Song, Song.MEDIA_FIELDS), (Playlist, ("cover",))]
+# GridFS files being removed with --delete-gridfs, one entry per document
+# field, so a run interrupted halfway can finish them instead of leaving
+# files no document points at
+PENDING_DELETIONS = "gridfs_pending_deletions"
+
+
+class Command(BaseCommand):
+    help = "Copy GridFS media into the filesystem blob store (safe to re-run)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--delete-gridfs",
+            action="store_true",
+            help="Remove each GridFS file once its document points at the copy",
+        )
+
+    def migrate(self, document, field, backend, fs, delete_gridfs):
+        collection = document._get_collection()
+        blob_field = f"{field}_blob"
+
+        # Documents still without a copy, plus copied ones still holding the
+        # GridFS file when it has to be removed: an interrupted run resumes
+        # exactly where it stopped
+        query = {field: {"$ne": None}}
+        if not delete_gridfs:
+            query[blob_field] = None
+
+        copied = removed = missing = 0
+        for row in collection.find(query, {field: 1, blob_field: 1}):
+            file_id = row[field]
+
+            if not row.get(blob_field):
+                try:
+                    grid_file = fs.get(file_id)
+                except NoFile:
+                    missing += 1
+                    continue
+
+                ref = backend.save(grid_file, content_type=grid_file.content_type)
+                # Keep the upload date so Last-Modified does not change
+                ref.uploaded_at = grid_file.upload_date
+                collection.update_one(
+                    {"_id": row["_id"], field: file_id},
+                    {"$set": {blob_field: ref.to_mongo()}},
+                )
+                copied += 1
+
+            if delete_gridfs:
+                entry = {
+                    "collection": collection.name,
+                    "document": row["_id"],
+                    "field": field,
+                    "file_id": file_id,
+                    "state": "recorded",
+                }
+                entry["_id"] = get_db()[PENDING_DELETIONS].insert_one(entry).inserted_id
+                self.remove_gridfs(entry)
+                removed += 1
+
+        return copied, removed, missing
+
+    def referenced(self, file_id):
+        return any(
+            document._get_collection().count_documents({field: file_id}, limit=1)
+            for document, fields in MIGRATED
+            for field in fields
+        )
+
+    def remove_gridfs(self, entry):
+        """Unset the FileField of a pending deletion, then drop its GridFS file"""
+        pending = get_db()[PENDING_DELETIONS]
+        file_id = entry["file_id"]
+
+        if entry["state"] == "recorded":
+            get_db()[entry["collection"]].update_one(
+                {"_id": entry["document"], entry["field"]: file_id},
+                {"$set": {entry["field"]: None}},
+            )
+            pending.update_one({"_id": entry["_id"]}, {"$set": {"state": "releasing"}})
+            # The GridFS file may be shared with other documents
+            GridFSBackend().delete(
+                BlobRef(backend=GridFSBackend.name, key=str(file_id), length=0)
+            )
+        elif self.referenced(file_id):
+            # Interrupted while releasing it, whether its reference was
+            # dropped is unknown: keep the entry until no document points
+            # at the file any more
+            return False
+        else:
+            StoredBlob.objects(backend=GridFSBackend.name, key=str(file_id)).delete()
+            GridFSBackend().discard(str(file_id))
+
+        pending.delete_one({"_id": entry["_id"]})
+        return True
+
+    def resume_deletions(self):
+        return sum(
+            self.remove_gridfs(entry) for entry in get_db()[PENDING_DELETIONS].find()
+        )
+
+    def handle(self, *args, **options):
+        backend = FileSystemBackend()
+        fs = GridFS(get_db())
+
+        if options["delete_gridfs"]:
+            resumed = self.resume_deletions()
+            if resumed:
+                self.stdout.write(f"Finished {resumed} interrupted GridFS removals")
+
+        for document, fields in MIGRATED:
+            for field in fields:
+                copied, removed, missing = self.migrate(
+                    document, field, backend, fs, options["delete_gridfs"]
+                )
+                self.stdout.write(
+                    self.style.SUCCESS(
+                        f"{document._get_collection_name()}.{field}: "
+                        f"{copied} copied, {removed} removed from GridFS, "
+                        f"{missing} missing"
+                    )
+                )
+
+        if options["delete_gridfs"]:
+            # Entries kept while other documents still held their file
+            self.resume_deletions()
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from apps.songs.models import UploadSession
+from apps.songs.uploads import discard_upload
+
+
+class Command(BaseCommand):
+    help = "Remove expired resumable uploads and the chunks they stored"
+
+    def handle(self, *args, **options):
+        purged = 0
+        for session in UploadSession.findExpired():
+            discard_upload(session)
+            purged += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Purged {purged} expired uploads"))
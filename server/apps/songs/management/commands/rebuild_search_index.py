@@ -0,0 +1,61 @@
+from django.core.management.base import BaseCommand
+from pymongo import UpdateOne
+from apps.songs.models import Song, TrigramStat
+from apps.users.models import User
+from apps.playlists.models import Playlist
+from utils.search_text import search_terms, trigrams
+
+# (document, field the index is built from, whether it has a trigram index)
+SEARCHABLE = [(Song, "title", True), (User, "name", True), (Playlist, "name", False)]
+
+
+class Command(BaseCommand):
+    help = "Rebuild the prefix and trigram search indexes and trigram counts"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of documents updated per bulk write",
+        )
+
+    def rebuild(self, document, field, with_trigrams, batch_size):
+        collection = document._get_collection()
+        operations = []
+        total = 0
+
+        for row in collection.find({}, {field: 1}):
+            update = {"search_terms": search_terms(row.get(field))}
+            if with_trigrams:
+                update["trigrams"] = trigrams(row.get(field))
+
+            operations.append(UpdateOne({"_id": row["_id"]}, {"$set": update}))
+            if len(operations) >= batch_size:
+                collection.bulk_write(operations, ordered=False)
+                total += len(operations)
+                operations = []
+
+        if operations:
+            collection.bulk_write(operations, ordered=False)
+            total += len(operations)
+        return total
+
+    def handle(self, *args, **options):
+        for document, field, with_trigrams in SEARCHABLE:
+            # Make sure the multikey indexes exist before the first search
+            document.ensure_indexes()
+            total = self.rebuild(document, field, with_trigrams, options["batch_size"])
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"Indexed {total} {document._get_collection_name()} by {field}"
+                )
+            )
+            if with_trigrams:
+                # Fuzzy searches rank query trigrams by these counts
+                grams = TrigramStat.rebuild(
+                    document._get_collection(),
+                    {"deleted_at": None},
+                    options["batch_size"],
+                )
+                self.stdout.write(f"Counted {grams} distinct trigrams")
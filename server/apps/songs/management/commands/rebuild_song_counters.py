@@ -0,0 +1,64 @@
+from django.core.management.base import BaseCommand
+from pymongo import UpdateOne
+from apps.songs.models import Song
+from apps.listenedAt.models import ListenedAt
+from apps.downloadedAt.models import DownloadedAt
+
+
+class Command(BaseCommand):
+    help = "Rebuild Song.play_count and Song.download_count from history"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of songs updated per bulk write",
+        )
+
+    def count_by_song(self, document):
+        pipeline = [{"$group": {"_id": "$song", "count": {"$sum": 1}}}]
+        return {
+            row["_id"]: row["count"]
+            for row in document.objects.aggregate(pipeline)
+            if row["_id"] is not None
+        }
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+
+        play_counts = self.count_by_song(ListenedAt)
+        download_counts = self.count_by_song(DownloadedAt)
+
+        collection = Song._get_collection()
+        operations = []
+        updated = 0
+
+        for song in collection.find({}, {"_id": 1}):
+            song_id = song["_id"]
+            operations.append(
+                UpdateOne(
+                    {"_id": song_id},
+                    {
+                        "$set": {
+                            "play_count": play_counts.get(song_id, 0),
+                            "download_count": download_counts.get(song_id, 0),
+                        }
+                    },
+                )
+            )
+            if len(operations) >= batch_size:
+                updated += collection.bulk_write(
+                    operations, ordered=False
+                ).modified_count
+                operations = []
+
+        if operations:
+            updated += collection.bulk_write(operations, ordered=False).modified_count
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Rebuilt counters from {sum(play_counts.values())} listens and "
+                f"{sum(download_counts.values())} downloads ({updated} songs changed)"
+            )
+        )
@@ -0,0 +1,477 @@
+import asyncio
+import calendar
+import uuid
+from collections import namedtuple
+from functools import partial
+from bson import ObjectId
+from django.conf import settings
+from django.core.cache import cache
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+from gridfs.errors import CorruptGridFile
+from mongoengine.connection import get_db
+from utils.async_db import get_async_db
+from utils.blob_storage import BlobRef, GridFSBackend, get_backend
+from .chunk_cache import chunk_cache_for
+from .models import Song
+
+# GridFS blobs are never modified in place: a new upload always gets a new id,
+# so a response can be cached for as long as browsers allow
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# More ranges than this (after merging) are ignored and the whole file is sent
+MAX_RANGES = 16
+# fs.chunks documents fetched per cursor batch (255 KB each by default)
+CHUNK_BATCH_SIZE = 16
+# Bytes read per step when a range of a filesystem blob is streamed
+FILE_BLOCK_SIZE = 256 * 1024
+
+
+# The fs.files fields needed to answer a media request
+MediaFile = namedtuple(
+    "MediaFile", ["id", "length", "chunk_size", "upload_date", "content_type"]
+)
+
+
+# What serving a song's audio/video/cover needs, cached per song and field.
+# path is set for filesystem blobs, None for GridFS files
+MediaDescriptor = namedtuple("MediaDescriptor", ["title", "media_file", "path"])
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def media_file_from_blob(ref):
+    """MediaFile for a filesystem BlobRef, its sha256 key doubles as the ETag"""
+    return MediaFile(ref.key, ref.length, None, ref.uploaded_at, ref.content_type)
+
+
+def media_file_from_document(document):
+    """Build a MediaFile from a raw fs.files document"""
+    return MediaFile(
+        document["_id"],
+        document["length"],
+        document["chunkSize"],
+        document.get("uploadDate"),
+        document.get("contentType"),
+    )
+
+
+def media_etag(file_id):
+    return f'"{file_id}"'
+
+
+def to_timestamp(upload_date):
+    if upload_date is None:
+        return None
+    return calendar.timegm(upload_date.utctimetuple())
+
+
+def set_cache_headers(response, etag, last_modified=None):
+    response["ETag"] = etag
+    if last_modified is not None:
+        response["Last-Modified"] = http_date(last_modified)
+    response["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+    return response
+
+
+def not_modified_response(request, etag, last_modified=None):
+    """
+    Evaluate If-None-Match / If-Modified-Since (and If-Match /
+    If-Unmodified-Since) against the blob validators.
+
+    Returns the 304/412 response to send, or None when the body is needed.
+    """
+    headers = set_cache_headers(HttpResponse(), etag, last_modified)
+    response = get_conditional_response(
+        request, etag=etag, last_modified=last_modified, response=headers
+    )
+    return None if response is headers else response
+
+
+def parse_range_header(header, size):
+    """
+    Parse "bytes=0-99,200-,-500" into sorted, merged (start, end) pairs.
+
+    Returns None when the header is absent, malformed or should be ignored,
+    and raises RangeNotSatisfiable when no range overlaps the file.
+    """
+    if not header or size <= 0:
+        return None
+    unit, _, specs = header.partition("=")
+    if unit.strip().lower() != "bytes" or not specs:
+        return None
+
+    ranges = []
+    for spec in specs.split(","):
+        first, dash, last = spec.strip().partition("-")
+        if not dash:
+            return None
+        try:
+            if first:
+                start = int(first)
+                end = int(last) if last else size - 1
+                if last and start > end:
+                    return None
+            else:
+                suffix = int(last)
+                if suffix <= 0:
+                    continue
+                start, end = max(size - suffix, 0), size - 1
+        except ValueError:
+            return None
+
+        if start < size:
+            ranges.append((start, min(end, size - 1)))
+
+    if not ranges:
+        raise RangeNotSatisfiable()
+
+    ranges.sort()
+    merged = [ranges[0]]
+    for start, end in ranges[1:]:
+        last_start, last_end = merged[-1]
+        if start <= last_end + 1:
+            merged[-1] = (last_start, max(last_end, end))
+        else:
+            merged.append((start, end))
+
+    return merged if len(merged) <= MAX_RANGES else None
+
+
+def if_range_matches(request, etag, last_modified):
+    """A Range is only honoured when If-Range (if any) still matches the blob"""
+    if_range = request.headers.get("If-Range", "").strip()
+    if not if_range:
+        return True
+    if if_range.startswith(('"', "W/")):
+        # If-Range requires a strong comparison
+        return if_range == etag
+    return last_modified is not None and parse_http_date_safe(if_range) == last_modified
+
+
+def chunk_cursor(db, media_file, first, last):
+    """Batched fs.chunks cursor over chunk numbers first..last, works for motor too"""
+    return (
+        db["fs.chunks"]
+        .find(
+            {"files_id": media_file.id, "n": {"$gte": first, "$lte": last}},
+            {"_id": 0, "n": 1, "data": 1},
+        )
+        .sort("n", 1)
+        .batch_size(CHUNK_BATCH_SIZE)
+    )
+
+
+def missing_run(cache, media_file, n, last):
+    """Last chunk number of the run of uncached chunks starting at n"""
+    if cache is None:
+        return last
+    end = n
+    while end < last and not cache.contains((media_file.id, end + 1)):
+        end += 1
+    return end
+
+
+def store_chunk(cache, media_file, chunk, expected):
+    if chunk["n"] != expected:
+        raise CorruptGridFile(f"missing chunk number {expected}")
+    if cache is not None:
+        cache.put((media_file.id, expected), chunk["data"])
+    return chunk["data"]
+
+
+def cached_chunk(cache, media_file, n):
+    return cache.get((media_file.id, n)) if cache is not None else None
+
+
+def trim_chunk(media_file, n, data, start, end):
+    offset = n * media_file.chunk_size
+    low = max(start - offset, 0)
+    high = min(end - offset + 1, len(data))
+    return data if low == 0 and high == len(data) else data[low:high]
+
+
+def iter_range(media_file, start, end):
+    """
+    Yield bytes start..end (inclusive) of a GridFS file one stored chunk at a
+    time. Chunks come from the chunk cache when possible, every run of
+    uncached chunks is read with one batched cursor and added to the cache.
+    Video is not cached (see CACHED_CONTENT_TYPES) and read in one cursor.
+
+    Only the first and last chunk are sliced, every chunk in between is
+    yielded as stored.
+    """
+    if end < start:
+        return
+
+    cache = chunk_cache_for(media_file.content_type)
+    n, last = start // media_file.chunk_size, end // media_file.chunk_size
+    while n <= last:
+        data = cached_chunk(cache, media_file, n)
+        if data is not None:
+            yield trim_chunk(media_file, n, data, start, end)
+            n += 1
+            continue
+
+        run_end = missing_run(cache, media_file, n, last)
+        for chunk in chunk_cursor(get_db(), media_file, n, run_end):
+            data = store_chunk(cache, media_file, chunk, n)
+            yield trim_chunk(media_file, n, data, start, end)
+            n += 1
+        if n <= run_end:
+            raise CorruptGridFile(f"missing chunk number {n}")
+
+
+async def aiter_range(media_file, start, end):
+    """Async version of iter_range() reading fs.chunks through motor"""
+    if end < start:
+        return
+
+    cache = chunk_cache_for(media_file.content_type)
+    n, last = start // media_file.chunk_size, end // media_file.chunk_size
+    while n <= last:
+        data = cached_chunk(cache, media_file, n)
+        if data is not None:
+            yield trim_chunk(media_file, n, data, start, end)
+            n += 1
+            continue
+
+        run_end = missing_run(cache, media_file, n, last)
+        async for chunk in chunk_cursor(get_async_db(), media_file, n, run_end):
+            data = store_chunk(cache, media_file, chunk, n)
+            yield trim_chunk(media_file, n, data, start, end)
+            n += 1
+        if n <= run_end:
+            raise CorruptGridFile(f"missing chunk number {n}")
+
+
+def iter_file_range(path, start, end):
+    with open(path, "rb") as blob:
+        blob.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            data = blob.read(min(FILE_BLOCK_SIZE, remaining))
+            if not data:
+                break
+            yield data
+            remaining -= len(data)
+
+
+async def aiter_file_range(path, start, end):
+    """iter_file_range() with every disk read done off the event loop"""
+    loop = asyncio.get_running_loop()
+    blocks = iter_file_range(path, start, end)
+    try:
+        while True:
+            data = await loop.run_in_executor(None, next, blocks, None)
+            if data is None:
+                break
+            yield data
+    finally:
+        blocks.close()
+
+
+def iter_segments(segments, read_range):
+    for segment in segments:
+        if isinstance(segment, bytes):
+            yield segment
+        else:
+            yield from read_range(*segment)
+
+
+def prepare_media_response(request, media_file, content_type, filename=None):
+    """
+    Work out the response for a media request with conditional request,
+    Range and If-Range support: 200 for the whole file, 206 for one range,
+    multipart/byteranges for several, 416 when nothing requested overlaps.
+
+    Returns (response, segments). When segments is None the response is
+    complete (304, 412, 416). Otherwise the response only carries status and
+    headers, and its body is the list of segments in order: bytes to send as
+    is, or (start, end) ranges of the file to stream.
+    """
+    etag = media_etag(media_file.id)
+    last_modified = to_timestamp(media_file.upload_date)
+    not_modified = not_modified_response(request, etag, last_modified)
+    if not_modified:
+        return not_modified, None
+
+    size = media_file.length
+    ranges = None
+    if if_range_matches(request, etag, last_modified):
+        try:
+            ranges = parse_range_header(request.headers.get("Range"), size)
+        except RangeNotSatisfiable:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{size}"
+            response["Accept-Ranges"] = "bytes"
+            return response, None
+
+    if not ranges:
+        response = StreamingHttpResponse(content_type=content_type)
+        response["Content-Length"] = str(size)
+        segments = [(0, size - 1)]
+    elif len(ranges) == 1:
+        start, end = ranges[0]
+        response = StreamingHttpResponse(status=206, content_type=content_type)
+        response["Content-Length"] = str(end - start + 1)
+        response["Content-Range"] = f"bytes {start}-{end}/{size}"
+        segments = [(start, end)]
+    else:
+        boundary = uuid.uuid4().hex
+        segments = []
+        for start, end in ranges:
+            segments.append(
+                (
+                    f"\r\n--{boundary}\r\n"
+                    f"Content-Type: {content_type}\r\n"
+                    f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n"
+                ).encode()
+            )
+            segments.append((start, end))
+        segments.append(f"\r\n--{boundary}--\r\n".encode())
+
+        response = StreamingHttpResponse(
+            status=206, content_type=f"multipart/byteranges; boundary={boundary}"
+        )
+        response["Content-Length"] = str(
+            sum(
+                (
+                    len(segment)
+                    if isinstance(segment, bytes)
+                    else segment[1] - segment[0] + 1
+                )
+                for segment in segments
+            )
+        )
+
+    response["Accept-Ranges"] = "bytes"
+    if filename:
+        response["Content-Disposition"] = f'inline; filename="{filename}"'
+    return set_cache_headers(response, etag, last_modified), segments
+
+
+def serve_media(request, descriptor, default_content_type, filename=None):
+    """
+    Serve a song's media from its descriptor, no metadata query is needed. A
+    whole filesystem blob is returned as a FileResponse so the WSGI server
+    can hand the file to sendfile().
+    """
+    media_file = descriptor.media_file
+    response, segments = prepare_media_response(
+        request,
+        media_file,
+        media_file.content_type or default_content_type,
+        filename,
+    )
+    if segments is None:
+        return response
+
+    if descriptor.path is None:
+        read_range = partial(iter_range, media_file)
+    elif response.status_code == 200:
+        file_response = FileResponse(
+            open(descriptor.path, "rb"), content_type=response["Content-Type"]
+        )
+        for name, value in response.items():
+            file_response[name] = value
+        return file_response
+    else:
+        read_range = partial(iter_file_range, descriptor.path)
+
+    response.streaming_content = iter_segments(segments, read_range)
+    return response
+
+
+def media_source(row, field):
+    """The filesystem BlobRef or the GridFS file id a raw document points at"""
+    blob = row.get(f"{field}_blob")
+    if not blob:
+        return None, row.get(field)
+
+    ref = BlobRef._from_son(blob)
+    if ref.backend == GridFSBackend.name:
+        return None, ObjectId(ref.key)
+    return ref, None
+
+
+def song_media_query(song_id, field):
+    return (
+        {"_id": ObjectId(song_id), "deleted_at": None},
+        {"title": 1, field: 1, f"{field}_blob": 1},
+    )
+
+
+def descriptor_from_blob(row, ref):
+    path = get_backend(ref.backend).path(ref.key)
+    return MediaDescriptor(row.get("title"), media_file_from_blob(ref), path)
+
+
+def descriptor_from_document(row, document):
+    media_file = media_file_from_document(document) if document else None
+    return MediaDescriptor(row.get("title"), media_file, None)
+
+
+def describe_media(row, field):
+    """MediaDescriptor of a FileField (or <field>_blob) of a raw document"""
+    ref, file_id = media_source(row, field)
+    if ref:
+        return descriptor_from_blob(row, ref)
+    document = get_db()["fs.files"].find_one({"_id": file_id}) if file_id else None
+    return descriptor_from_document(row, document)
+
+
+def load_media_descriptor(song_id, field):
+    song = get_db()[Song._get_collection_name()].find_one(
+        *song_media_query(song_id, field)
+    )
+    return describe_media(song, field) if song else None
+
+
+async def aload_media_descriptor(song_id, field):
+    db = get_async_db()
+    song = await db[Song._get_collection_name()].find_one(
+        *song_media_query(song_id, field)
+    )
+    if not song:
+        return None
+
+    ref, file_id = media_source(song, field)
+    if ref:
+        return descriptor_from_blob(song, ref)
+    document = await db["fs.files"].find_one({"_id": file_id}) if file_id else None
+    return descriptor_from_document(song, document)
+
+
+def get_media_descriptor(song_id, field):
+    """
+    Cached MediaDescriptor of a song's audio/video/cover. Returns None when
+    the song does not exist, and a descriptor without media_file when the
+    file it points at is missing.
+    """
+    if not ObjectId.is_valid(song_id):
+        return None
+
+    key = Song.mediaDescriptorKey(song_id, field)
+    descriptor = cache.get(key)
+    if descriptor is None:
+        descriptor = load_media_descriptor(song_id, field)
+        if descriptor and descriptor.media_file:
+            cache.set(key, descriptor, settings.MEDIA_DESCRIPTOR_TTL)
+    return descriptor
+
+
+async def aget_media_descriptor(song_id, field):
+    """Async version of get_media_descriptor() for the ASGI consumer"""
+    if not ObjectId.is_valid(song_id):
+        return None
+
+    key = Song.mediaDescriptorKey(song_id, field)
+    descriptor = cache.get(key)
+    if descriptor is None:
+        descriptor = await aload_media_descriptor(song_id, field)
+        if descriptor and descriptor.media_file:
+            cache.set(key, descriptor, settings.MEDIA_DESCRIPTOR_TTL)
+    return descriptor
@@ -6,27 +6,80 @@ from mongoengine import (
     ListField,
     ReferenceField,
     DateTimeField,
+    EmbeddedDocument,
+    EmbeddedDocumentField,
+    MapField,
+    ObjectIdField,
     DoesNotExist,
     ValidationError,
 )
 from apps.genre.models import Genre
+from apps.jobs.models import Job
 from apps.users.models import User
-from datetime import datetime
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.core.cache import cache
 from bson import ObjectId
+from utils.blob_storage import (
+    BACKENDS,
+    BlobRef,
+    media_refs,
+    release_blobs,
+    store_uploads,
+)
+from utils.search_text import (
+    search_terms,
+    query_terms,
+    relevance,
+    trigrams,
+    candidate_trigrams,
+    similarity_pipeline,
+)
 
 
 class Song(Document):
     title = StringField(required=True)
     genre = ListField(ReferenceField(Genre))
-    audio = FileField(required=True)
-    video = FileField(required=True)
-    cover = FileField(required=True)
+    # GridFS files, or a reference into MEDIA_STORAGE_BACKEND in <field>_blob
+    audio = FileField()
+    video = FileField()
+    cover = FileField()
+    audio_blob = EmbeddedDocumentField(BlobRef)
+    video_blob = EmbeddedDocumentField(BlobRef)
+    cover_blob = EmbeddedDocumentField(BlobRef)
     user = ReferenceField(User, required=True, default=None)
     duration = IntField(required=True)
     released_at = DateTimeField(required=True)
     deleted_at = DateTimeField(default=None, null=True)
+    play_count = IntField(default=0)
+    download_count = IntField(default=0)
+    search_terms = ListField(StringField())
+    trigrams = ListField(StringField())
+    # Post-upload work (apps/songs/jobs.py): pending -> processing -> ready
+    processing_status = StringField(
+        default="ready", choices=("pending", "processing", "ready", "failed")
+    )
+
+    meta = {
+        "collection": "songs",
+        "indexes": [
+            ("deleted_at", "-play_count"),
+            ("deleted_at", "-download_count"),
+            "search_terms",
+            "trigrams",
+            "processing_status",
+        ],
+    }
 
-    meta = {"collection": "songs"}
+    MEDIA_FIELDS = ("audio", "video", "cover")
+
+    def clean(self):
+        for field in Song.MEDIA_FIELDS:
+            if not (self[field] or self[f"{field}_blob"]):
+                raise ValidationError(f"Field {field} is required")
+
+        self.search_terms = search_terms(self.title)
+        self.trigrams = trigrams(self.title)
 
     @staticmethod
     def findAll():
@@ -51,23 +104,119 @@ class Song(Document):
 
     @staticmethod
     def create(data):
+        # The song is only saved once every file is written
+        written = store_uploads(data, Song.MEDIA_FIELDS)
         try:
-            song = Song(**data)
+            song = Song(**data, processing_status="pending")
             song.save()
-            return song
         except ValidationError as e:
+            release_blobs(written)
             return ValueError(f"Invalid data: {str(e)}")
+        except Exception:
+            release_blobs(written)
+            raise
+
+        # The request returns once the files are stored, the rest runs on
+        # the job workers. A song that could not be queued is left pending
+        # for requeue_pending_songs to pick up
+        try:
+            Job.enqueue("songs.process_media", {"song_id": str(song.id)})
+        except Exception as e:
+            print(f"Error queueing processing of song {song.id}: {e}")
+        return song
+
+    @staticmethod
+    def setProcessingStatus(song_id, processing_status, **fields):
+        return (
+            Song.objects(id=song_id).update_one(
+                set__processing_status=processing_status,
+                **{f"set__{name}": value for name, value in fields.items()},
+            )
+            > 0
+        )
+
+    @staticmethod
+    def findUnqueued(grace):
+        """
+        Ids of songs waiting for media processing without a queued or running
+        job, saved more than grace seconds ago
+        """
+        saved_before = ObjectId.from_datetime(
+            datetime.utcnow() - timedelta(seconds=grace)
+        )
+        rows = Song._get_collection().find(
+            {
+                "processing_status": {"$in": ["pending", "processing"]},
+                "deleted_at": None,
+                "_id": {"$lt": saved_before},
+            },
+            {"_id": 1},
+        )
+        song_ids = [str(row["_id"]) for row in rows]
+        if not song_ids:
+            return []
+
+        queued = set(
+            Job._get_collection().distinct(
+                "payload.song_id",
+                {
+                    "kind": "songs.process_media",
+                    "status": {"$in": ["queued", "running"]},
+                    "payload.song_id": {"$in": song_ids},
+                },
+            )
+        )
+        return [song_id for song_id in song_ids if song_id not in queued]
+
+    @staticmethod
+    def mediaDescriptorKey(song_id, field):
+        """Cache key of the media descriptor used by the streaming views"""
+        return f"song-media:{song_id}:{field}"
 
     @staticmethod
     def delete_many(song_ids):
         try:
-            result = Song.objects.filter(id__in=song_ids, deleted_at=None).update(
-                deleted_at=datetime.now()
+            deleted_at = datetime.now()
+            result = 0
+            for song_id in song_ids:
+                # One call per song hands its media to exactly one deleter
+                song = Song.objects(id=song_id, deleted_at=None).modify(
+                    set__deleted_at=deleted_at
+                )
+                if song:
+                    result += 1
+                    release_blobs(
+                        [
+                            ref
+                            for field in Song.MEDIA_FIELDS
+                            for ref in media_refs(song, field)
+                        ]
+                    )
+            cache.delete_many(
+                [
+                    Song.mediaDescriptorKey(song_id, field)
+                    for song_id in song_ids
+                    for field in Song.MEDIA_FIELDS
+                ]
             )
             return result > 0
         except DoesNotExist:
             return False
 
+    @staticmethod
+    def totalPlaysByUsers(user_ids):
+        pipeline = [{"$group": {"_id": "$user", "total": {"$sum": "$play_count"}}}]
+        songs = Song.objects(user__in=list(user_ids), deleted_at=None)
+        return {row["_id"]: row["total"] for row in songs.aggregate(pipeline)}
+
+    @staticmethod
+    def incrementPlayCount(song_id):
+        return Song.objects(id=song_id).update_one(inc__play_count=1) > 0
+
+    @staticmethod
+    def incrementDownloadCount(song_id):
+        return Song.objects(id=song_id).update_one(inc__download_count=1) > 0
+
     @staticmethod
     def search(query, genre):
         try:
@@ -81,13 +230,248 @@ class Song(Document):
                     return []
 
             if query:
-                filters["title__icontains"] = query
+                terms = query_terms(query)
+                if not terms:
+                    return []
+                filters["search_terms__all"] = terms
 
-            song_list = Song.objects.filter(**filters)
-            return list(song_list)
+            song_list = list(Song.objects.filter(**filters).order_by("-play_count"))
+            if query:
+                # Stable sort: equally relevant songs keep the play_count order
+                song_list.sort(
+                    key=lambda song: relevance(song.title, query), reverse=True
+                )
+            return song_list
 
         except DoesNotExist:
             return []
         except Exception as e:
             print(f"[Song.search] Error: {e}")
             return []
+
+    @staticmethod
+    def fuzzySearch(query, genre=None, limit=20):
+        try:
+            grams = trigrams(query)
+            if not grams:
+                return []
+
+            match = {"deleted_at": None}
+            if genre:
+                genre_obj = Genre.objects(name__iexact=genre).first()
+                if not genre_obj:
+                    return []
+                match["genre"] = genre_obj.id
+
+            # Only the rarest trigrams are looked up, common ones like "  t"
+            # would pull in a large part of the catalogue before scoring
+            rows = TrigramStat.similar(Song._get_collection(), match, grams, limit)
+            song_ids = [row["_id"] for row in rows]
+            songs = Song.objects.in_bulk(song_ids)
+            return [songs[song_id] for song_id in song_ids if song_id in songs]
+
+        except Exception as e:
+            print(f"[Song.fuzzySearch] Error: {e}")
+            return []
+
+
+# Trigrams held by fewer documents are never skipped, whatever their share
+MIN_SKIPPED_FREQUENCY = 1000
+
+
+class TrigramStat(Document):
+    """
+    Number of documents of a collection holding a trigram. Fuzzy searches
+    look up the rarest query trigrams first, rebuild_search_index refreshes
+    the counts.
+    """
+
+    # Collection the trigram was counted in, e.g. "songs"
+    scope = StringField(required=True)
+    gram = StringField(required=True)
+    count = IntField(required=True)
+
+    meta = {
+        "collection": "trigram_stats",
+        "indexes": [{"fields": ("scope", "gram"), "unique": True}],
+    }
+
+    @staticmethod
+    def frequencies(scope, grams):
+        rows = TrigramStat._get_collection().find(
+            {"scope": scope, "gram": {"$in": list(grams)}}, {"gram": 1, "count": 1}
+        )
+        return {row["gram"]: row["count"] for row in rows}
+
+    @staticmethod
+    def candidates(collection, grams):
+        """
+        (pruned, exact) trigrams of a fuzzy query to look documents of
+        collection up by. Both hold the rarest trigrams every match shares
+        one of, pruned also leaves out those too common to look up.
+        """
+        frequencies = TrigramStat.frequencies(collection.name, grams)
+        max_frequency = max(
+            MIN_SKIPPED_FREQUENCY,
+            settings.FUZZY_SEARCH_MAX_TRIGRAM_SHARE
+            * collection.estimated_document_count(),
+        )
+        return (
+            candidate_trigrams(grams, frequencies, max_frequency),
+            candidate_trigrams(grams, frequencies),
+        )
+
+    @staticmethod
+    def similar(collection, match, grams, limit):
+        """
+        Rows ({_id, similarity}) of the documents matching match most similar
+        to the query trigrams. Looked up by the pruned trigrams first, then
+        by the exact ones when that leaves fewer than limit matches; the
+        exact lookup finds the same matches as one by every trigram.
+        """
+        pruned, exact = TrigramStat.candidates(collection, grams)
+        looked_up = pruned
+        while True:
+            rows = list(
+                collection.aggregate(
+                    [{"$match": {**match, "trigrams": {"$in": looked_up}}}]
+                    + similarity_pipeline(grams, limit)
+                )
+            )
+            if len(rows) >= limit or len(looked_up) >= len(exact):
+                return rows
+            looked_up = exact
+
+    @staticmethod
+    def rebuild(collection, match=None, batch_size=1000):
+        """Recount the trigrams of the documents of collection matching match"""
+        TrigramStat.ensure_indexes()
+        scope = collection.name
+        pipeline = [
+            {"$match": match or {}},
+            {"$unwind": "$trigrams"},
+            {"$group": {"_id": "$trigrams", "count": {"$sum": 1}}},
+        ]
+        stats = TrigramStat._get_collection()
+        stats.delete_many({"scope": scope})
+
+        rows = []
+        total = 0
+        for row in collection.aggregate(pipeline, allowDiskUse=True):
+            rows.append({"scope": scope, "gram": row["_id"], "count": row["count"]})
+            if len(rows) >= batch_size:
+                stats.insert_many(rows, ordered=False)
+                total += len(rows)
+                rows = []
+        if rows:
+            stats.insert_many(rows, ordered=False)
+            total += len(rows)
+        return total
+
+
+# Seconds after which a chunk PUT still counted as writing is taken to have
+# died, so it no longer keeps the session from being finalized
+UPLOAD_WRITE_TIMEOUT = 600
+
+
+class UploadFile(EmbeddedDocument):
+    """One file of a resumable upload"""
+
+    length = IntField(required=True, min_value=1)
+    content_type = StringField()
+    filename = StringField()
+    # GridFS id the chunks are written under, reserved when the upload starts
+    file_id = ObjectIdField(default=ObjectId)
+    # Numbers of the chunks stored so far
+    received = ListField(IntField())
+
+    def chunkCount(self, chunk_size):
+        return -(-self.length // chunk_size)
+
+    def isComplete(self, chunk_size):
+        return len(set(self.received)) == self.chunkCount(chunk_size)
+
+
+class UploadSession(Document):
+    """
+    Song media uploaded in chunks across several requests. Song.create only
+    runs once every file is complete and the session is finalized.
+    """
+
+    user = ReferenceField(User, required=True)
+    backend = StringField(required=True, choices=tuple(BACKENDS))
+    chunk_size = IntField(required=True)
+    files = MapField(EmbeddedDocumentField(UploadFile))
+    # "open" while chunks are accepted, "finalizing" while the song is created
+    state = StringField(default="open", choices=("open", "finalizing"))
+    # Chunk PUTs in progress, finalize waits for them
+    writers = IntField(default=0)
+    written_at = DateTimeField()
+    created_at = DateTimeField(default=datetime.utcnow)
+    expires_at = DateTimeField(required=True)
+
+    meta = {"collection": "upload_sessions", "indexes": ["user", "expires_at"]}
+
+    @staticmethod
+    def findActive(upload_id, user):
+        try:
+            return UploadSession.objects.get(
+                id=upload_id, user=user, expires_at__gt=datetime.utcnow()
+            )
+        except (DoesNotExist, ValidationError):
+            return None
+
+    @staticmethod
+    def findExpired():
+        return UploadSession.objects(expires_at__lte=datetime.utcnow())
+
+    @staticmethod
+    def markReceived(upload_id, field, numbers):
+        UploadSession._get_collection().update_one(
+            {"_id": upload_id},
+            {"$addToSet": {f"files.{field}.received": {"$each": numbers}}},
+        )
+
+    @staticmethod
+    def beginWrite(upload_id, field, chunk_count):
+        """
+        Count a chunk PUT in, False once the session is finalizing or the
+        file already has every chunk
+        """
+        result = UploadSession._get_collection().update_one(
+            {
+                "_id": upload_id,
+                "state": "open",
+                f"files.{field}.received.{chunk_count - 1}": {"$exists": False},
+            },
+            {"$inc": {"writers": 1}, "$set": {"written_at": datetime.utcnow()}},
+        )
+        return result.modified_count > 0
+
+    @staticmethod
+    def endWrite(upload_id):
+        UploadSession._get_collection().update_one(
+            {"_id": upload_id},
+            {"$inc": {"writers": -1}, "$set": {"written_at": datetime.utcnow()}},
+        )
+
+    @staticmethod
+    def claim(upload_id):
+        """
+        Move an open session nobody writes to to finalizing, False if
+        another request did or chunks are still being written
+        """
+        stale = datetime.utcnow() - timedelta(seconds=UPLOAD_WRITE_TIMEOUT)
+        result = UploadSession._get_collection().update_one(
+            {
+                "_id": upload_id,
+                "state": "open",
+                "$or": [{"writers": {"$lte": 0}}, {"written_at": {"$lt": stale}}],
+            },
+            {"$set": {"state": "finalizing", "writers": 0}},
+        )
+        return result.modified_count > 0
+
+    @staticmethod
+    def release(upload_id):
+        UploadSession.objects(id=upload_id).update_one(set__state="open")
@@ -8,6 +8,24 @@ from bson import ObjectId
 from mongoengine.errors import DoesNotExist
 from datetime import datetime
 from apps.playlists.serializers import PlaylistSerializer
+from utils.reference_loader import get_reference_loader
+
+
+def prefetch_listened_at_counts(context, song_ids):
+    """Load listen counts of many songs into the serializer context at once"""
+    counts = context.setdefault("listened_at_counts", {})
+    missing = [song_id for song_id in song_ids if str(song_id) not in counts]
+    if missing:
+        counts.update(ListenedAt.countBySongs(missing))
+    return counts
+
+
+class SongListSerializer(serializers.ListSerializer):
+    """Resolves artists and genres of the whole list in bulk"""
+
+    def to_representation(self, data):
+        songs = get_reference_loader(self.context).load(list(data), "user", "genre")
+        return super().to_representation(songs)
 
 
 class SongSerializer(serializers.Serializer):
@@ -20,6 +38,10 @@ class SongSerializer(serializers.Serializer):
     deleted_at = serializers.DateTimeField(
         read_only=True, required=False, allow_null=True
     )
+    processing_status = serializers.CharField(read_only=True)
+
+    class Meta:
+        list_serializer_class = SongListSerializer
 
     def get_genre(self, obj):
         if not obj.genre:
@@ -30,41 +52,58 @@ class SongSerializer(serializers.Serializer):
         try:
             if not obj.user:
                 return None
-            return UserDetailSerializer(obj.user).data
+            return UserDetailSerializer(obj.user, context=self.context).data
         except DoesNotExist:
             return None  # Return None if user reference is invalid
 
 
+class EnhancedSongListSerializer(SongListSerializer):
+    """Also counts listens of the whole list in one aggregation"""
+
+    def to_representation(self, data):
+        songs = list(data)
+        prefetch_listened_at_counts(self.context, [song.id for song in songs])
+        return super().to_representation(songs)
+
+
 class EnhancedSongSerializer(SongSerializer):
     audio_url = serializers.SerializerMethodField()
     video_url = serializers.SerializerMethodField()
     cover_url = serializers.SerializerMethodField()
     listened_at_count = serializers.SerializerMethodField()
+    play_count = serializers.IntegerField(read_only=True)
+    download_count = serializers.IntegerField(read_only=True)
 
     def get_audio_url(self, obj):
         request = self.context.get("request")
-        if request and obj.audio and hasattr(obj.audio, "grid_id"):
+        if request and (obj.audio or obj.audio_blob):
             base_url = request.build_absolute_uri("/").rstrip("/")
             return f"{base_url}/api/songs/{obj.id}/audio"   
         return None
 
     def get_video_url(self, obj):
         request = self.context.get("request")
-        if request and obj.video and hasattr(obj.video, "grid_id"):
+        if request and (obj.video or obj.video_blob):
             base_url = request.build_absolute_uri("/").rstrip("/")
             return f"{base_url}/api/songs/{obj.id}/video"
         return None
 
     def get_cover_url(self, obj):
         request = self.context.get("request")
-        if request and obj.cover and hasattr(obj.cover, "grid_id"):
+        if request and (obj.cover or obj.cover_blob):
             base_url = request.build_absolute_uri("/").rstrip("/")
             return f"{base_url}/api/songs/{obj.id}/cover"
         return None
 
     def get_listened_at_count(self, obj):
+        counts = self.context.get("listened_at_counts", {})
+        if str(obj.id) in counts:
+            return counts[str(obj.id)]
         return ListenedAt.objects.filter(song=obj).count()
 
+    class Meta:
+        list_serializer_class = EnhancedSongListSerializer
+
 
 class SongCreateSerializer(serializers.Serializer):
     """Serializer for creating songs with file uploads"""
@@ -130,6 +169,28 @@ class SongCreateSerializer(serializers.Serializer):
         return Song.create(validated_data)
 
 
+class SongUploadFinalizeSerializer(SongCreateSerializer):
+    """Song fields sent to finish a resumable upload, the files come from it"""
+
+    audio = None
+    video = None
+    cover = None
+
+
+class UploadFileSerializer(serializers.Serializer):
+    length = serializers.IntegerField(min_value=1)
+    content_type = serializers.CharField(required=False)
+    filename = serializers.CharField(required=False)
+
+
+class SongUploadInitSerializer(serializers.Serializer):
+    """Files announced when a resumable upload starts, all required by Song"""
+
+    audio = UploadFileSerializer()
+    video = UploadFileSerializer()
+    cover = UploadFileSerializer()
+
+
 class SearchSerializer(serializers.Serializer):
     songs = EnhancedSongSerializer(required=False, many=True)
     users = UserDetailSerializer(required=False, many=True)
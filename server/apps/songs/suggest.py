@@ -0,0 +1,133 @@
+import bisect
+import heapq
+import threading
+import time
+from apps.genre.models import Genre
+from apps.songs.models import Song
+from apps.users.models import User
+from utils.search_text import tokenize
+
+# Seconds before the in-memory index is rebuilt from MongoDB
+SUGGEST_INDEX_TTL = 60
+
+
+class SuggestionIndex:
+    """
+    Sorted array of normalized keys for prefix completion.
+
+    Every word position of a name gets its own key ("em cua ngay", "cua ngay",
+    "ngay"), so a prefix matches the start of any word. A lookup is two
+    binary searches plus a top-k selection by play count.
+    """
+
+    def __init__(self, entries):
+        self.items = []
+        rows = []
+        for text, kind, object_id, play_count in entries:
+            words = tokenize(text)
+            if not words:
+                continue
+            position = len(self.items)
+            self.items.append(
+                {
+                    "text": text,
+                    "type": kind,
+                    "id": str(object_id),
+                    "play_count": play_count,
+                }
+            )
+            for start in range(len(words)):
+                rows.append((" ".join(words[start:]), position))
+
+        rows.sort()
+        self.keys = [key for key, _ in rows]
+        self.positions = [position for _, position in rows]
+
+    def complete(self, prefix, limit=10):
+        prefix = " ".join(tokenize(prefix))
+        if not prefix:
+            return []
+
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        low = bisect.bisect_left(self.keys, prefix)
+        high = bisect.bisect_left(self.keys, upper, low)
+
+        matches = set(self.positions[low:high])
+        best = heapq.nlargest(
+            limit, matches, key=lambda position: self.items[position]["play_count"]
+        )
+        return [self.items[position] for position in best]
+
+
+def _load_entries():
+    songs = Song.objects(deleted_at=None).only("title", "play_count").as_pymongo()
+    for song in songs:
+        yield song.get("title"), "song", song["_id"], song.get("play_count", 0)
+
+    artist_plays = {
+        row["_id"]: row["play_count"]
+        for row in Song.objects(deleted_at=None).aggregate(
+            [{"$group": {"_id": "$user", "play_count": {"$sum": "$play_count"}}}]
+        )
+    }
+    users = User.objects(deleted_at=None, role="user").only("name").as_pymongo()
+    for user in users:
+        yield user.get("name"), "artist", user["_id"], artist_plays.get(user["_id"], 0)
+
+    genre_plays = {
+        row["_id"]: row["play_count"]
+        for row in Song.objects(deleted_at=None).aggregate(
+            [
+                {"$unwind": "$genre"},
+                {"$group": {"_id": "$genre", "play_count": {"$sum": "$play_count"}}},
+            ]
+        )
+    }
+    for genre in Genre.objects.only("name").as_pymongo():
+        yield genre.get("name"), "genre", genre["_id"], genre_plays.get(genre["_id"], 0)
+
+
+_index = None
+_built_at = 0.0
+_rebuilding = False
+_lock = threading.Lock()
+
+
+def _rebuild():
+    global _index, _built_at, _rebuilding
+
+    try:
+        index = SuggestionIndex(_load_entries())
+        with _lock:
+            _index = index
+    except Exception as e:
+        print(f"[suggest] Error rebuilding index: {e}")
+    finally:
+        with _lock:
+            # A failed build is retried after another TTL, not on every request
+            _built_at = time.monotonic()
+            _rebuilding = False
+
+
+def get_suggestion_index():
+    """
+    Only the very first call builds the index inline. Once stale it is still
+    served while a background thread builds the next one and swaps it in.
+    """
+    global _index, _built_at, _rebuilding
+
+    index = _index
+    if index is None:
+        with _lock:
+            if _index is None:
+                _index = SuggestionIndex(_load_entries())
+                _built_at = time.monotonic()
+            return _index
+
+    if time.monotonic() - _built_at > SUGGEST_INDEX_TTL:
+        with _lock:
+            start = not _rebuilding
+            _rebuilding = True
+        if start:
+            threading.Thread(target=_rebuild, name="suggest-index", daemon=True).start()
+    return index
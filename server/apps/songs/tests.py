@@ -1,3 +1,310 @@
-from django.test import TestCase
+import io
+import os
+import tempfile
+from datetime import datetime
+from unittest import mock
+from django.core.management import call_command
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from django.utils.http import http_date
+from mongoengine.connection import get_db
+from rest_framework.test import APIRequestFactory, force_authenticate
+from apps.users.models import User
+from utils.blob_storage import FileSystemBackend, StoredBlob, media_refs
+from utils.search_text import trigrams
+from utils.testing import MongoTestCase
+from .media import (
+    MAX_RANGES,
+    MediaFile,
+    RangeNotSatisfiable,
+    parse_range_header,
+    prepare_media_response,
+    to_timestamp,
+)
+from .management.commands.import_songs import Checkpoint
+from .models import Song, TrigramStat, UploadSession
+from .uploads import UPLOAD_CHUNK_SIZE, FileSystemStaging, start_upload
+from .views import SongUploadChunkView, SongUploadFinalizeView
 
-# Create your tests here.
+UPLOADED_AT = datetime(2024, 5, 1, 12, 0, 0)
+MEDIA_FILE = MediaFile("abc", 1000, 255 * 1024, UPLOADED_AT, "audio/mpeg")
+
+
+class ParseRangeHeaderTests(SimpleTestCase):
+    # (Range header, file size, expected ranges), None when it is ignored
+    CASES = [
+        (None, 1000, None),
+        ("", 1000, None),
+        ("bytes=0-99", 1000, [(0, 99)]),
+        ("bytes=500-", 1000, [(500, 999)]),
+        ("bytes=-200", 1000, [(800, 999)]),
+        ("bytes=-5000", 1000, [(0, 999)]),
+        ("bytes=900-5000", 1000, [(900, 999)]),
+        ("BYTES = 0-0", 1000, [(0, 0)]),
+        # Several ranges come back sorted, overlapping or adjacent ones merged
+        ("bytes=0-99,200-299", 1000, [(0, 99), (200, 299)]),
+        ("bytes=200-299,0-99", 1000, [(0, 99), (200, 299)]),
+        ("bytes=0-99,50-149,150-199", 1000, [(0, 199)]),
+        ("bytes=0-9,-10", 1000, [(0, 9), (990, 999)]),
+        ("bytes=0-9,2000-", 1000, [(0, 9)]),
+        ("bytes=-0,0-9", 1000, [(0, 9)]),
+        # Malformed or unsupported headers are ignored
+        ("items=0-9", 1000, None),
+        ("bytes=", 1000, None),
+        ("bytes=10", 1000, None),
+        ("bytes=a-b", 1000, None),
+        ("bytes=9-0", 1000, None),
+        ("bytes=0-9", 0, None),
+        (
+            "bytes=" + ",".join(f"{n * 10}-{n * 10}" for n in range(MAX_RANGES + 1)),
+            1000,
+            None,
+        ),
+    ]
+    UNSATISFIABLE = ["bytes=1000-", "bytes=1000-1999", "bytes=-0", "bytes=5000-,-0"]
+
+    def test_ranges(self):
+        for header, size, expected in self.CASES:
+            with self.subTest(header=header, size=size):
+                self.assertEqual(parse_range_header(header, size), expected)
+
+    def test_unsatisfiable(self):
+        for header in self.UNSATISFIABLE:
+            with self.subTest(header=header):
+                with self.assertRaises(RangeNotSatisfiable):
+                    parse_range_header(header, 1000)
+
+
+class PrepareMediaResponseTests(SimpleTestCase):
+    # (request headers, expected status, expected Content-Range)
+    CASES = [
+        ({}, 200, None),
+        ({"HTTP_RANGE": "bytes=0-99"}, 206, "bytes 0-99/1000"),
+        ({"HTTP_RANGE": "bytes=-100"}, 206, "bytes 900-999/1000"),
+        ({"HTTP_RANGE": "bytes=0-9,20-29"}, 206, None),
+        ({"HTTP_RANGE": "bytes=1000-"}, 416, "bytes */1000"),
+        # If-Range: the range is only sent while the validator still matches
+        (
+            {"HTTP_RANGE": "bytes=0-99", "HTTP_IF_RANGE": '"abc"'},
+            206,
+            "bytes 0-99/1000",
+        ),
+        ({"HTTP_RANGE": "bytes=0-99", "HTTP_IF_RANGE": '"old"'}, 200, None),
+        ({"HTTP_RANGE": "bytes=0-99", "HTTP_IF_RANGE": 'W/"abc"'}, 200, None),
+        (
+            {
+                "HTTP_RANGE": "bytes=0-99",
+                "HTTP_IF_RANGE": http_date(to_timestamp(UPLOADED_AT)),
+            },
+            206,
+            "bytes 0-99/1000",
+        ),
+        (
+            {"HTTP_RANGE": "bytes=0-99", "HTTP_IF_RANGE": http_date(0)},
+            200,
+            None,
+        ),
+        ({"HTTP_RANGE": "bytes=1000-", "HTTP_IF_RANGE": '"old"'}, 200, None),
+    ]
+
+    def test_status(self):
+        factory = RequestFactory()
+        for headers, status, content_range in self.CASES:
+            with self.subTest(headers=headers):
+                request = factory.get("/", **headers)
+                response, _ = prepare_media_response(
+                    request, MEDIA_FILE, MEDIA_FILE.content_type
+                )
+                self.assertEqual(response.status_code, status)
+                self.assertEqual(response.get("Content-Range"), content_range)
+
+    def test_multiple_ranges(self):
+        request = RequestFactory().get("/", HTTP_RANGE="bytes=0-9,20-29")
+        response, segments = prepare_media_response(
+            request, MEDIA_FILE, MEDIA_FILE.content_type
+        )
+
+        self.assertTrue(response["Content-Type"].startswith("multipart/byteranges"))
+        self.assertEqual(
+            [s for s in segments if isinstance(s, tuple)], [(0, 9), (20, 29)]
+        )
+        body_length = sum(
+            len(s) if isinstance(s, bytes) else s[1] - s[0] + 1 for s in segments
+        )
+        self.assertEqual(int(response["Content-Length"]), body_length)
+
+
+class SongDeleteTests(MongoTestCase):
+    def setUp(self):
+        self.user = User(name="A", email="a@example.com", password="x").save()
+
+    def create(self, audio):
+        return Song.create(
+            {
+                "title": "Song",
+                "user": self.user,
+                "duration": 60,
+                "released_at": UPLOADED_AT,
+                "audio": io.BytesIO(audio),
+                "video": io.BytesIO(b"video " + audio),
+                "cover": io.BytesIO(b"cover " + audio),
+            }
+        )
+
+    def test_deleting_songs_releases_their_media(self):
+        song = self.create(b"audio")
+        other = self.create(b"other audio")
+
+        self.assertTrue(Song.delete_many([song.id]))
+        # Deleting it again releases nothing more
+        self.assertFalse(Song.delete_many([song.id]))
+
+        for field in Song.MEDIA_FIELDS:
+            (deleted,) = media_refs(song, field)
+            (kept,) = media_refs(other, field)
+            self.assertFalse(StoredBlob.objects(key=deleted.key))
+            self.assertEqual(StoredBlob.objects.get(key=kept.key).refs, 1)
+
+
+class FuzzySearchTests(MongoTestCase):
+    def test_common_trigrams_are_looked_up_when_rare_ones_find_too_few(self):
+        collection = get_db()["fuzzy_titles"]
+        grams = trigrams("hello world")
+        # Every trigram counts as too common, so only the first one is looked
+        # up at first, and the title holds all but that one
+        TrigramStat._get_collection().insert_many(
+            [{"scope": collection.name, "gram": gram, "count": 5000} for gram in grams]
+        )
+        missing = min(grams)
+        collection.insert_one(
+            {
+                "trigrams": [gram for gram in grams if gram != missing],
+                "deleted_at": None,
+            }
+        )
+
+        pruned, exact = TrigramStat.candidates(collection, grams)
+        self.assertEqual(pruned, [missing])
+        rows = TrigramStat.similar(collection, {"deleted_at": None}, grams, 20)
+        self.assertEqual(len(rows), 1)
+
+
+class ImportCheckpointTests(MongoTestCase):
+    def setUp(self):
+        User(name="A", email="a@example.com", password="x").save()
+        source = tempfile.TemporaryDirectory()
+        self.addCleanup(source.cleanup)
+        self.source = source.name
+        self.addCleanup(
+            lambda: os.path.exists(self.checkpoint) and os.remove(self.checkpoint)
+        )
+        self.checkpoint = f"{self.source}.import-checkpoint"
+        for name in ("one", "two"):
+            for extension in (".mp3", ".mp4", ".jpg"):
+                with open(os.path.join(self.source, name + extension), "wb") as f:
+                    f.write(f"{name}{extension}".encode())
+
+    def run_import(self):
+        call_command(
+            "import_songs", self.source, user="a@example.com", stdout=io.StringIO()
+        )
+
+    def test_restart_releases_blobs_of_songs_never_inserted(self):
+        # Stopped once every file is stored, before the songs are inserted
+        with mock.patch.object(Checkpoint, "record", side_effect=KeyboardInterrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                self.run_import()
+        self.assertEqual(Song.objects.count(), 0)
+        self.assertEqual(StoredBlob.objects(refs=1).count(), 6)
+
+        self.run_import()
+        self.assertEqual(Song.objects.count(), 2)
+        self.assertEqual(StoredBlob.objects.count(), 6)
+        self.assertEqual(StoredBlob.objects(refs=1).count(), 6)
+
+        # Imported entries are skipped and nothing is released again
+        self.run_import()
+        self.assertEqual(Song.objects.count(), 2)
+        self.assertEqual(StoredBlob.objects(refs=1).count(), 6)
+
+
+class ResumableUploadTests(MongoTestCase):
+    AUDIO = bytes(range(256)) * (UPLOAD_CHUNK_SIZE // 128) + b"end"
+
+    def setUp(self):
+        self.user = User(name="A", email="a@example.com", password="x").save()
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        media_settings = override_settings(
+            MEDIA_BLOB_ROOT=root.name, MEDIA_STORAGE_BACKEND="filesystem"
+        )
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        self.session = start_upload(
+            self.user,
+            {"audio": {"length": len(self.AUDIO), "content_type": "audio/mpeg"}},
+        )
+
+    def put(self, start, end):
+        request = APIRequestFactory().put(
+            "/",
+            self.AUDIO[start : end + 1],
+            content_type="application/octet-stream",
+            HTTP_CONTENT_RANGE=f"bytes {start}-{end}/{len(self.AUDIO)}",
+        )
+        force_authenticate(request, user=self.user)
+        return SongUploadChunkView.as_view()(
+            request, upload_id=str(self.session.id), field="audio"
+        )
+
+    def put_chunk(self, n):
+        start = n * UPLOAD_CHUNK_SIZE
+        return self.put(start, min(start + UPLOAD_CHUNK_SIZE, len(self.AUDIO)) - 1)
+
+    def finalize(self):
+        request = APIRequestFactory().post("/", {}, format="json")
+        force_authenticate(request, user=self.user)
+        return SongUploadFinalizeView.as_view()(request, upload_id=str(self.session.id))
+
+    def test_ranges_must_be_aligned_on_chunks(self):
+        self.assertEqual(self.put(1, UPLOAD_CHUNK_SIZE).status_code, 400)
+        self.assertEqual(self.put(0, UPLOAD_CHUNK_SIZE).status_code, 400)
+        self.assertEqual(self.put(0, len(self.AUDIO)).status_code, 400)
+        self.assertEqual(self.put(0, UPLOAD_CHUNK_SIZE - 1).status_code, 200)
+        self.assertEqual(self.put(0, len(self.AUDIO) - 1).status_code, 200)
+        # Chunks of a complete file are refused
+        self.assertEqual(self.put(0, UPLOAD_CHUNK_SIZE - 1).status_code, 409)
+
+    def test_upload_resumes_at_the_first_missing_chunk(self):
+        self.put_chunk(0)
+        progress = self.put_chunk(2).data["files"]["audio"]
+        self.assertEqual(progress["next_offset"], UPLOAD_CHUNK_SIZE)
+        self.assertFalse(progress["complete"])
+        self.assertEqual(self.finalize().status_code, 409)
+
+        progress = self.put_chunk(1).data["files"]["audio"]
+        self.assertEqual(progress["next_offset"], len(self.AUDIO))
+        self.assertEqual(progress["received"], len(self.AUDIO))
+        self.assertTrue(progress["complete"])
+
+    def test_finalize_and_chunk_writes_exclude_each_other(self):
+        self.assertTrue(UploadSession.beginWrite(self.session.id, "audio", 3))
+        self.assertFalse(UploadSession.claim(self.session.id))
+
+        UploadSession.endWrite(self.session.id)
+        self.assertTrue(UploadSession.claim(self.session.id))
+        self.assertEqual(self.put_chunk(0).status_code, 409)
+
+    def test_staged_file_is_linked_into_the_blob_store(self):
+        for n in range(3):
+            self.put_chunk(n)
+        self.session.reload()
+        staging = FileSystemStaging(self.session, "audio")
+
+        ref = staging.commit()["audio_blob"]
+        path = FileSystemBackend().path(ref.key)
+        self.assertTrue(os.path.samefile(path, staging.path))
+
+        staging.close()
+        with open(path, "rb") as stored:
+            self.assertEqual(stored.read(), self.AUDIO)
+        self.assertEqual(StoredBlob.objects.get(key=ref.key).refs, 1)
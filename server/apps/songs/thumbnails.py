@@ -0,0 +1,141 @@
+import io
+from django.conf import settings
+from django.core.cache import cache
+from bson import ObjectId
+from gridfs import GridFS
+from gridfs.errors import FileExists
+from mongoengine.connection import get_db
+from PIL import Image, ImageOps, UnidentifiedImageError
+from .media import MediaDescriptor, MediaFile, iter_range, media_file_from_document
+
+# Bounding boxes (px) a cover can be requested at with ?size=
+COVER_SIZES = (64, 300, 640)
+# ?type= value -> (Pillow format, content type). Not ?format=, which DRF
+# reserves for picking a renderer
+THUMBNAIL_FORMATS = {"webp": ("WEBP", "image/webp"), "jpeg": ("JPEG", "image/jpeg")}
+THUMBNAIL_QUALITY = 82
+# Unique per source file, size and format, so concurrent first requests
+# store a variant once
+VARIANT_INDEX = "cover_variants"
+# Non-unique index of the same keys it replaces
+LEGACY_VARIANT_INDEX = "metadata.variant_of_1_metadata.size_1_metadata.format_1"
+
+_index_ready = False
+
+
+def parse_thumbnail_params(params):
+    """(size, format) from ?size=&type=, or (None, None) for the original"""
+    size = params.get("size")
+    if not size:
+        return None, None
+
+    if not size.isdigit() or int(size) not in COVER_SIZES:
+        sizes = ", ".join(str(value) for value in COVER_SIZES)
+        raise ValueError(f"size must be one of {sizes}")
+    image_format = params.get("type", "webp").lower()
+    if image_format not in THUMBNAIL_FORMATS:
+        raise ValueError(f"type must be one of {', '.join(THUMBNAIL_FORMATS)}")
+    return int(size), image_format
+
+
+def read_original(descriptor):
+    if descriptor.path:
+        with open(descriptor.path, "rb") as original:
+            return original.read()
+    media_file = descriptor.media_file
+    return b"".join(iter_range(media_file, 0, media_file.length - 1))
+
+
+def render_thumbnail(content, size, image_format):
+    image = ImageOps.exif_transpose(Image.open(io.BytesIO(content)))
+    # Keeps the aspect ratio and never upscales a small cover
+    image.thumbnail((size, size))
+
+    pil_format, _ = THUMBNAIL_FORMATS[image_format]
+    if pil_format == "JPEG" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+
+    output = io.BytesIO()
+    image.save(output, pil_format, quality=THUMBNAIL_QUALITY)
+    return output.getvalue()
+
+
+def _drop_duplicate_variants(files):
+    """Keep one variant per key, stored twice before the index was unique"""
+    pipeline = [
+        {"$match": {"metadata.variant_of": {"$exists": True}}},
+        {"$group": {"_id": "$metadata", "ids": {"$push": "$_id"}}},
+        {"$match": {"ids.1": {"$exists": True}}},
+    ]
+    fs = GridFS(get_db())
+    for group in files.aggregate(pipeline):
+        for file_id in group["ids"][1:]:
+            fs.delete(file_id)
+
+
+def _variants():
+    global _index_ready
+
+    files = get_db()["fs.files"]
+    if not _index_ready:
+        if LEGACY_VARIANT_INDEX in files.index_information():
+            files.drop_index(LEGACY_VARIANT_INDEX)
+            _drop_duplicate_variants(files)
+        files.create_index(
+            [("metadata.variant_of", 1), ("metadata.size", 1), ("metadata.format", 1)],
+            name=VARIANT_INDEX,
+            unique=True,
+            # Leaves out original files, which have none of the keys
+            sparse=True,
+        )
+        _index_ready = True
+    return files
+
+
+def get_thumbnail_descriptor(descriptor, size, image_format):
+    """
+    Descriptor of a resized cover. Variants are rendered on first request
+    and stored in GridFS next to the original, tagged with the id of the
+    file they were made from, so a replaced cover gets new variants.
+    """
+    source_id = str(descriptor.media_file.id)
+    key = f"cover-variant:{source_id}:{size}:{image_format}"
+    variant = cache.get(key)
+    if variant is not None:
+        return variant
+
+    metadata = {"variant_of": source_id, "size": size, "format": image_format}
+    query = {f"metadata.{name}": value for name, value in metadata.items()}
+    document = _variants().find_one(query)
+    if document:
+        media_file = media_file_from_document(document)
+    else:
+        try:
+            content = render_thumbnail(read_original(descriptor), size, image_format)
+        except (UnidentifiedImageError, Image.DecompressionBombError, OSError) as e:
+            print("Error resizing cover, sending the original:", e)
+            return descriptor
+
+        _, content_type = THUMBNAIL_FORMATS[image_format]
+        fs = GridFS(get_db())
+        file_id = ObjectId()
+        try:
+            with fs.new_file(
+                _id=file_id, content_type=content_type, metadata=metadata
+            ) as grid_in:
+                grid_in.write(content)
+            media_file = MediaFile(
+                grid_in._id,
+                grid_in.length,
+                grid_in.chunk_size,
+                grid_in.upload_date,
+                content_type,
+            )
+        except FileExists:
+            # Another request stored the same variant first, use that one
+            fs.delete(file_id)
+            media_file = media_file_from_document(_variants().find_one(query))
+
+    variant = MediaDescriptor(descriptor.title, media_file, None)
+    cache.set(key, variant, settings.MEDIA_DESCRIPTOR_TTL)
+    return variant
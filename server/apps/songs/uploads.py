@@ -0,0 +1,268 @@
+import os
+import re
+import shutil
+from datetime import datetime, timedelta
+from bson import Binary
+from django.conf import settings
+from gridfs import DEFAULT_CHUNK_SIZE
+from mongoengine.connection import get_db
+from mongoengine.fields import GridFSProxy
+from utils.blob_storage import FileSystemBackend, content_digest, get_backend
+from .models import UploadFile, UploadSession
+
+# Clients send byte ranges aligned on this size, which is also the size of
+# the GridFS chunks written, so every chunk maps to exactly one fs.chunks row
+UPLOAD_CHUNK_SIZE = DEFAULT_CHUNK_SIZE
+
+CONTENT_RANGE_RE = re.compile(r"^bytes (\d+)-(\d+)/(\d+|\*)$")
+
+_chunk_index_ready = False
+
+
+class GridFSStaging:
+    """
+    Chunks go straight into fs.chunks under the file id reserved when the
+    upload started. The fs.files row is only written at finalize, so GridFS
+    readers never see a partial file.
+    """
+
+    def __init__(self, session, field):
+        self.field = field
+        self.upload = session.files[field]
+        self.chunk_size = session.chunk_size
+        self.db = get_db()
+
+    def write(self, n, data):
+        global _chunk_index_ready
+
+        chunks = self.db["fs.chunks"]
+        if not _chunk_index_ready:
+            chunks.create_index([("files_id", 1), ("n", 1)], unique=True)
+            _chunk_index_ready = True
+
+        # A resent chunk replaces the stored one
+        chunk = {"files_id": self.upload.file_id, "n": n, "data": Binary(data)}
+        chunks.replace_one(
+            {"files_id": self.upload.file_id, "n": n}, chunk, upsert=True
+        )
+
+    def commit(self):
+        self.db["fs.files"].update_one(
+            {"_id": self.upload.file_id},
+            {
+                "$setOnInsert": {
+                    "length": self.upload.length,
+                    "chunkSize": self.chunk_size,
+                    "uploadDate": datetime.utcnow(),
+                    "contentType": self.upload.content_type,
+                    "filename": self.upload.filename,
+                }
+            },
+            upsert=True,
+        )
+        return {self.field: GridFSProxy(grid_id=self.upload.file_id)}
+
+    def rollback(self):
+        # Chunks stay so finalize can be retried
+        self.db["fs.files"].delete_one({"_id": self.upload.file_id})
+
+    def close(self):
+        pass
+
+    def discard(self):
+        self.db["fs.chunks"].delete_many({"files_id": self.upload.file_id})
+
+
+class FileSystemStaging:
+    """
+    Chunks are written in place into a sparse file under
+    MEDIA_BLOB_ROOT/uploads/<session>/. At finalize it is hashed and
+    hard-linked into the blob store rather than copied; chunks of a complete
+    file are refused, so the linked file never changes.
+    """
+
+    def __init__(self, session, field):
+        self.field = field
+        self.upload = session.files[field]
+        self.chunk_size = session.chunk_size
+        self.path = os.path.join(session_dir(session), field)
+        self.ref = None
+
+    def write(self, n, data):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # No truncation, so concurrent requests for other ranges are kept
+        handle = os.open(self.path, os.O_WRONLY | os.O_CREAT, 0o644)
+        try:
+            os.pwrite(handle, data, n * self.chunk_size)
+        finally:
+            os.close(handle)
+
+    def commit(self):
+        backend = FileSystemBackend()
+        with open(self.path, "rb") as staged:
+            digest = content_digest(staged)
+
+        self.ref = backend.acquire(digest)
+        if not self.ref:
+            # The staged path stays for a retry of finalize until close()
+            linked = f"{self.path}.{digest}"
+            if os.path.exists(linked):
+                os.remove(linked)
+            os.link(self.path, linked)
+            self.ref = backend.store(
+                digest, digest, self.upload.length, self.upload.content_type, linked
+            )
+        return {f"{self.field}_blob": self.ref}
+
+    def rollback(self):
+        if self.ref:
+            FileSystemBackend().delete(self.ref)
+            self.ref = None
+
+    def close(self):
+        self.discard()
+
+    def discard(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+STAGING = {"gridfs": GridFSStaging, "filesystem": FileSystemStaging}
+
+
+def session_dir(session):
+    return os.path.join(settings.MEDIA_BLOB_ROOT, "uploads", str(session.id))
+
+
+def staging_for(session, field):
+    return STAGING[session.backend](session, field)
+
+
+def start_upload(user, files):
+    """New session for files ({field: {length, content_type, filename}})"""
+    session = UploadSession(
+        user=user,
+        backend=get_backend().name,
+        chunk_size=UPLOAD_CHUNK_SIZE,
+        files={field: UploadFile(**spec) for field, spec in files.items()},
+        expires_at=datetime.utcnow()
+        + timedelta(hours=settings.UPLOAD_SESSION_TTL_HOURS),
+    )
+    session.save()
+    return session
+
+
+def upload_status(session):
+    status = {}
+    for field, upload in session.files.items():
+        received = set(upload.received)
+        count = upload.chunkCount(session.chunk_size)
+        missing = next((n for n in range(count) if n not in received), None)
+        status[field] = {
+            "length": upload.length,
+            "received": sum(
+                min(session.chunk_size, upload.length - n * session.chunk_size)
+                for n in received
+            ),
+            # Where the client should resume sending
+            "next_offset": (
+                upload.length if missing is None else missing * session.chunk_size
+            ),
+            "complete": missing is None,
+        }
+    return status
+
+
+def parse_content_range(header, upload, chunk_size):
+    """(start, end) of a chunk PUT, aligned on chunk boundaries"""
+    match = CONTENT_RANGE_RE.match(header or "")
+    if not match:
+        raise ValueError("Content-Range must be 'bytes <start>-<end>/<length>'")
+
+    start, end = int(match.group(1)), int(match.group(2))
+    total = match.group(3)
+    if total != "*" and int(total) != upload.length:
+        raise ValueError(f"Upload length is {upload.length}")
+    if start > end or end >= upload.length:
+        raise ValueError("Range is outside the file")
+    if start % chunk_size or ((end + 1) % chunk_size and end != upload.length - 1):
+        raise ValueError(f"Ranges must be aligned on {chunk_size} bytes")
+    return start, end
+
+
+def read_exactly(stream, size):
+    data = bytearray()
+    while len(data) < size:
+        block = stream.read(size - len(data))
+        if not block:
+            break
+        data += block
+    return bytes(data)
+
+
+def write_range(session, field, stream, start, end):
+    """
+    Copy bytes start..end from the request body into the staging area one
+    chunk at a time, so memory stays bounded by the chunk size. Returns the
+    number of bytes stored; a body cut short keeps its complete chunks.
+    """
+    staging = staging_for(session, field)
+    chunk_size = session.chunk_size
+    written = []
+    position = start
+
+    try:
+        while position <= end:
+            size = min(chunk_size, end + 1 - position)
+            data = read_exactly(stream, size) if stream else b""
+            if len(data) < size:
+                break
+            staging.write(position // chunk_size, data)
+            written.append(position // chunk_size)
+            position += size
+    finally:
+        if written:
+            UploadSession.markReceived(session.id, field, written)
+
+    return position - start
+
+
+def rollback(stagings):
+    for staging in stagings:
+        staging.rollback()
+
+
+def finalize_upload(session, serializer):
+    """
+    Turn the staged files into media and create the song through the
+    serializer. The session is removed once the song exists; on failure the
+    staged chunks are kept so finalize can be retried.
+    """
+    stagings = [staging_for(session, field) for field in session.files]
+    committed = []
+    media = {}
+    try:
+        for staging in stagings:
+            media.update(staging.commit())
+            committed.append(staging)
+
+        song = serializer.save(**media)
+        if isinstance(song, ValueError):
+            rollback(committed)
+            return song
+    except Exception:
+        rollback(committed)
+        raise
+
+    for staging in stagings:
+        staging.close()
+    shutil.rmtree(session_dir(session), ignore_errors=True)
+    session.delete()
+    return song
+
+
+def discard_upload(session):
+    for field in session.files:
+        staging_for(session, field).discard()
+    shutil.rmtree(session_dir(session), ignore_errors=True)
+    session.delete()
@@ -7,13 +7,31 @@ from .views import (
     SongFileView,
     SongCoverView,
     SongSearchView,
+    SongSuggestView,
     SongVideoView,
+    SongUploadStartView,
+    SongUploadView,
+    SongUploadChunkView,
+    SongUploadFinalizeView,
 )
 
 urlpatterns = [
     path("create/", SongCreateView.as_view(), name="song-create"),
+    path("uploads/", SongUploadStartView.as_view(), name="song-upload-start"),
+    path("uploads/<str:upload_id>/", SongUploadView.as_view(), name="song-upload"),
+    path(
+        "uploads/<str:upload_id>/finalize/",
+        SongUploadFinalizeView.as_view(),
+        name="song-upload-finalize",
+    ),
+    path(
+        "uploads/<str:upload_id>/<str:field>",
+        SongUploadChunkView.as_view(),
+        name="song-upload-chunk",
+    ),
     path("", SongListView.as_view(), name="song-list"),
     path("search/", SongSearchView.as_view(), name="song-search"),
+    path("suggest/", SongSuggestView.as_view(), name="song-suggest"),
     path("delete/", SongBulkDestroyView.as_view(), name="song-delete"),
     path("<str:song_id>/", SongDetailView.as_view(), name="song-detail"),
     path("<str:song_id>/audio", SongFileView.as_view(), name="song-audio"),
@@ -2,7 +2,9 @@ from .serializers import (
     UserDetailSerializer,
     EnhancedSongSerializer,
     PlaylistSerializer,
-    SongCreateSerializer
+    SongCreateSerializer,
+    SongUploadInitSerializer,
+    SongUploadFinalizeSerializer,
 )
 from apps.songs.models import Song
 from django.http import HttpResponse, StreamingHttpResponse
@@ -23,15 +25,43 @@ from rest_framework import status
 from bson import ObjectId
 from gridfs.errors import NoFile
 from apps.playlists.models import Playlist
+from utils.cursor_pagination import MongoCursorPagination
+from utils.reference_loader import get_reference_loader
+from .suggest import get_suggestion_index
+from .media import get_media_descriptor, serve_media
+from .thumbnails import get_thumbnail_descriptor, parse_thumbnail_params
+from .models import UploadSession
+from .uploads import (
+    discard_upload,
+    finalize_upload,
+    parse_content_range,
+    start_upload,
+    upload_status,
+    write_range,
+)
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from django.conf import settings
+import pymongo
+import time
 
 # Use the existing MongoDB connection from MongoEngine
 db = get_db()
 fs = GridFS(db)
 
+# Shared by every request so parallel searches cannot spawn unbounded threads
+search_executor = ThreadPoolExecutor(
+    max_workers=settings.SEARCH_MAX_WORKERS, thread_name_prefix="song-search"
+)
+
+
+class SongListPagination(MongoCursorPagination):
+    paginate_by_default = False
+
 
 class SongListView(ListCreateAPIView):
     serializer_class = EnhancedSongSerializer
     permission_classes = [AllowAny]
+    pagination_class = SongListPagination
 
     def get_queryset(self):
         return Song.findAll()
@@ -59,59 +89,21 @@ class SongFileView(APIView):
 
     def get(self, request, song_id):
         try:
-            song = Song.findById(song_id)
-            if not song:
+            # One cached lookup instead of findById + fs.exists + fs.get
+            descriptor = get_media_descriptor(song_id, "audio")
+            if not descriptor:
                 return Response(
                     {"error": "Song not found"}, status=status.HTTP_404_NOT_FOUND
                 )
-
-            file_id = song.audio.grid_id
-            if not fs.exists({"_id": ObjectId(file_id)}):
+            if not descriptor.media_file:
                 return Response(
                     {"error": "Audio file not found"}, status=status.HTTP_404_NOT_FOUND
                 )
 
-            grid_file = fs.get(ObjectId(file_id))
-            file_size = grid_file.length
-
-            range_header = request.headers.get("Range", "").strip()
-            start, end = 0, file_size - 1
-
-            if range_header.startswith("bytes="):
-                byte_range = range_header.replace("bytes=", "")
-                if "-" in byte_range:
-                    start_str, end_str = byte_range.split("-")
-                    start = int(start_str) if start_str else 0
-                    end = int(end_str) if end_str else file_size - 1
-
-            chunk_size = end - start + 1
-            grid_file.seek(start)
-
-            def stream_generator():
-                remaining = chunk_size
-                while remaining > 0:
-                    chunk = grid_file.read(min(8192, remaining))
-                    if not chunk:
-                        break
-                    yield chunk
-                    remaining -= len(chunk)
-
-            response = StreamingHttpResponse(
-                stream_generator(),
-                status=206,
-                content_type=grid_file.content_type or "audio/mpeg",
+            return serve_media(
+                request, descriptor, "audio/mpeg", filename=f"{descriptor.title}.mp3"
             )
-            response["Content-Disposition"] = f'inline; filename="{song.title}.mp3"'
-            response["Content-Length"] = str(chunk_size)
-            response["Content-Range"] = f"bytes {start}-{end}/{file_size}"
-            response["Accept-Ranges"] = "bytes"
-
-            return response
 
-        except NoFile:
-            return Response(
-                {"error": "File not found in GridFS"}, status=status.HTTP_404_NOT_FOUND
-            )
         except Exception as e:
             return Response(
                 {"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR
@@ -125,35 +117,21 @@ class SongVideoView(APIView):
 
     def get(self, request, song_id):
         try:
-            # Get the song document
-            song = Song.findById(song_id)
-            if not song:
+            descriptor = get_media_descriptor(song_id, "video")
+            if not descriptor:
                 return Response(
                     {"error": "Song not found"}, status=status.HTTP_404_NOT_FOUND
                 )
-
-            # Get the file_id from the song's video field
-            file_id = song.video.grid_id
-
-            # Retrieve the file from GridFS
-            if not fs.exists(file_id):
+            if not descriptor.media_file:
                 return Response(
                     {"error": "Video file not found"}, status=status.HTTP_404_NOT_FOUND
                 )
 
-            grid_file = fs.get(file_id)
-
-            # Create a streaming response
-            response = StreamingHttpResponse(
-                grid_file, content_type=grid_file.content_type or "video/mp4"
+            # Stream the requested byte ranges so the player can seek
+            return serve_media(
+                request, descriptor, "video/mp4", filename=f"{descriptor.title}.mp4"
             )
 
-            # Set content disposition and length headers
-            response["Content-Disposition"] = f'inline; filename="{song.title}.mp4"'
-            response["Content-Length"] = grid_file.length
-
-            return response
-
         except Exception as e:
             return Response(
                 {"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR
@@ -165,30 +143,25 @@ class SongCoverView(APIView):
 
     def get(self, request, song_id):
         try:
-            # Get the song document
-            song = Song.findById(song_id)
-            if not song:
+            descriptor = get_media_descriptor(song_id, "cover")
+            if not descriptor:
                 return Response(
                     {"error": "Song not found"}, status=status.HTTP_404_NOT_FOUND
                 )
-
-            # Get the file_id from the song's cover field
-            file_id = song.cover.grid_id
-
-            # Retrieve the file from GridFS
-            if not fs.exists(file_id):
+            if not descriptor.media_file:
                 return Response(
                     {"error": "Cover image not found"}, status=status.HTTP_404_NOT_FOUND
                 )
 
-            grid_file = fs.get(file_id)
-
-            # Create a response with the image data
-            response = HttpResponse(
-                grid_file.read(), content_type=grid_file.content_type or "image/jpeg"
-            )
+            # ?size=64|300|640 (&type=webp|jpeg) serves a resized variant
+            try:
+                size, image_format = parse_thumbnail_params(request.query_params)
+            except ValueError as e:
+                return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            if size:
+                descriptor = get_thumbnail_descriptor(descriptor, size, image_format)
 
-            return response
+            return serve_media(request, descriptor, "image/jpeg")
 
         except Exception as e:
             return Response(
@@ -221,6 +194,151 @@ class SongCreateView(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+class SongUploadStartView(APIView):
+    """
+    Start a resumable upload: the client announces the size of audio, video
+    and cover, then PUTs them in chunk-aligned byte ranges
+    """
+
+    parser_classes = [JSONParser]
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        serializer = SongUploadInitSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        session = start_upload(request.user, serializer.validated_data)
+        return Response(
+            {
+                "id": str(session.id),
+                "chunk_size": session.chunk_size,
+                "expires_at": session.expires_at,
+                "files": upload_status(session),
+            },
+            status=status.HTTP_201_CREATED,
+        )
+
+
+class SongUploadView(APIView):
+    """Progress of a resumable upload (GET) or abort it (DELETE)"""
+
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, upload_id):
+        session = UploadSession.findActive(upload_id, request.user)
+        if not session:
+            return Response(
+                {"error": "Upload not found"}, status=status.HTTP_404_NOT_FOUND
+            )
+        return Response({"id": str(session.id), "files": upload_status(session)})
+
+    def delete(self, request, upload_id):
+        session = UploadSession.findActive(upload_id, request.user)
+        if not session:
+            return Response(
+                {"error": "Upload not found"}, status=status.HTTP_404_NOT_FOUND
+            )
+        discard_upload(session)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class SongUploadChunkView(APIView):
+    """
+    PUT one byte range of a file with Content-Range: bytes <start>-<end>/<length>.
+    The body is read a chunk at a time and stored as it arrives.
+    """
+
+    permission_classes = [IsAuthenticated]
+
+    def put(self, request, upload_id, field):
+        session = UploadSession.findActive(upload_id, request.user)
+        if not session or field not in session.files:
+            return Response(
+                {"error": "Upload not found"}, status=status.HTTP_404_NOT_FOUND
+            )
+
+        upload = session.files[field]
+        try:
+            start, end = parse_content_range(
+                request.META.get("HTTP_CONTENT_RANGE"), upload, session.chunk_size
+            )
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Checked and counted in one update, so finalize never reads a file
+        # that is still being written
+        if not UploadSession.beginWrite(
+            session.id, field, upload.chunkCount(session.chunk_size)
+        ):
+            session.reload()
+            return Response(
+                {
+                    "error": "Upload is being finalized or the file is complete",
+                    "files": upload_status(session),
+                },
+                status=status.HTTP_409_CONFLICT,
+            )
+        try:
+            stored = write_range(session, field, request.stream, start, end)
+        finally:
+            UploadSession.endWrite(session.id)
+        session.reload()
+        files = upload_status(session)
+        if stored < end - start + 1:
+            return Response(
+                {"error": "Request body ended before the range", "files": files},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        return Response({"id": str(session.id), "files": files})
+
+
+class SongUploadFinalizeView(APIView):
+    """Create the song from a completed upload and the usual song fields"""
+
+    parser_classes = [JSONParser, MultiPartParser, FormParser]
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, upload_id):
+        session = UploadSession.findActive(upload_id, request.user)
+        if not session:
+            return Response(
+                {"error": "Upload not found"}, status=status.HTTP_404_NOT_FOUND
+            )
+
+        files = upload_status(session)
+        if not all(progress["complete"] for progress in files.values()):
+            return Response(
+                {"error": "Upload is incomplete", "files": files},
+                status=status.HTTP_409_CONFLICT,
+            )
+
+        serializer = SongUploadFinalizeSerializer(
+            data=request.data, context={"request": request}
+        )
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        if not UploadSession.claim(session.id):
+            return Response(
+                {"error": "Upload is being finalized or still receiving chunks"},
+                status=status.HTTP_409_CONFLICT,
+            )
+        try:
+            song = finalize_upload(session, serializer)
+        except Exception as e:
+            UploadSession.release(session.id)
+            return Response(
+                {"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+        if isinstance(song, ValueError):
+            UploadSession.release(session.id)
+            return Response({"error": str(song)}, status=status.HTTP_400_BAD_REQUEST)
+
+        response_serializer = EnhancedSongSerializer(song, context={"request": request})
+        return Response(response_serializer.data, status=status.HTTP_201_CREATED)
+
+
 class SongBulkDestroyView(APIView):
     permission_classes = [AllowAny]
     # permission_classes = [IsAuthenticated]
@@ -254,87 +372,127 @@ class SongBulkDestroyView(APIView):
             )
 
 
+class SongSuggestView(APIView):
+    """Prefix completions for the search box, ranked by play count"""
+
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        query = request.query_params.get("query", "").strip()
+        try:
+            limit = min(max(int(request.query_params.get("limit", 10)), 1), 50)
+        except ValueError:
+            limit = 10
+
+        suggestions = get_suggestion_index().complete(query, limit) if query else []
+        return Response({"suggestions": suggestions}, status=status.HTTP_200_OK)
+
+
+def run_before(deadline, function, *args):
+    """
+    Call function with every MongoDB operation it runs limited to what is
+    left until deadline (maxTimeMS), so a search that is given up on also
+    stops on the server
+    """
+    with pymongo.timeout(max(deadline - time.monotonic(), 0.001)):
+        return function(*args)
+
+
 class SongSearchView(APIView):
     permission_classes = [AllowAny]
 
-    def searchUserAndSortByListen(self, request, query):
+    def getResultLimit(self, request):
+        try:
+            limit = int(request.query_params.get("limit", settings.SEARCH_RESULT_LIMIT))
+        except ValueError:
+            limit = settings.SEARCH_RESULT_LIMIT
+        return min(max(limit, 1), 100)
+
+    def searchUserAndSortByListen(self, request, query, fuzzy=False, limit=None):
         # Filter users
-        users = User.search(query)
+        users = User.fuzzySearch(query) if fuzzy else User.search(query)
 
-        user_list = []
+        # Total listens per user from the song counters, without loading songs
+        total_listens = Song.totalPlaysByUsers([user.id for user in users])
 
-        for user in users:
-            # Get songs of the user
-            songs = Song.findAllByUser(user.id)
-            # Parse query_set to JSON
-            songs_serializer = EnhancedSongSerializer(
-                songs, many=True, context={"request": request}
-            )
-            # Calculate total of listens of user
-            total_listen = sum(
-                (song.get("listened_at_count", 0)) for song in songs_serializer.data
+        # Fuzzy results are already ranked by similarity
+        if not fuzzy:
+            users = sorted(
+                users, key=lambda user: total_listens.get(user.id, 0), reverse=True
             )
 
+        user_list = []
+
+        for user in users[:limit]:
             # Parse query_set to JSON
-            user_data = UserDetailSerializer(
-                user, context={"request": request}).data
+            user_data = UserDetailSerializer(user, context={"request": request}).data
 
-            user_data["total_listen"] = total_listen
+            user_data["total_listen"] = total_listens.get(user.id, 0)
 
             user_list.append(user_data)
 
-        sorted_users = sorted(
-            user_list, key=lambda x: x["total_listen"], reverse=True)
+        return user_list
 
-        return sorted_users
-
-    def searchSongAndSortByListen(self, request, query, genre):
-        songs = Song.search(query, genre)
+    def searchSongAndSortByListen(self, request, query, genre, fuzzy=False):
+        # Song.search already orders by the play_count counter,
+        # Song.fuzzySearch by trigram similarity
+        if fuzzy:
+            songs = Song.fuzzySearch(query, genre)
+        else:
+            songs = Song.search(query, genre)
 
-        songs_data = EnhancedSongSerializer(
+        return EnhancedSongSerializer(
             songs, many=True, context={"request": request}
         ).data
 
-        sorted_songs = sorted(
-            songs_data, key=lambda x: x["listened_at_count"], reverse=True
+    def searchPlaylistAndSortByListen(self, request, query, limit=None):
+        # Filtering, totals and ranking run in Mongo; only the top playlists
+        # are loaded and serialized
+        ranked = Playlist.searchRankedByListens(
+            query, limit or settings.SEARCH_RESULT_LIMIT
         )
 
-        return sorted_songs
-
-    def searchPlaylistAndSortByListen(self, request, query):
-        playlists = Playlist.search(query)
-
-        playlist_with_listen_data = []
-
-        for playlist in playlists:
-            # Chỉ lấy playlist có bài hát
-            if len(playlist.songs) == 0:
-                continue
-
-            playlist_data = PlaylistSerializer(
-                playlist, context={"request": request}
-            ).data
-
-            total_listen = sum(
-                (song.get("listened_at_count", 0))
-                for song in playlist_data.get("songs", [])
-            )
+        playlists_data = PlaylistSerializer(
+            [playlist for playlist, _ in ranked],
+            many=True,
+            context={"request": request},
+        ).data
 
+        for playlist_data, (_, total_listen) in zip(playlists_data, ranked):
             playlist_data["total_listen"] = total_listen
 
-            if playlist_data["is_favorite"] == False:
-                playlist_with_listen_data.append(playlist_data)
+        return playlists_data
 
-        sorted_playlists = sorted(
-            playlist_with_listen_data, key=lambda x: x["total_listen"], reverse=True
-        )
+    def searchAllConcurrently(self, request, response, branches):
+        """Run the sub-searches on the shared pool, keep whatever finishes in time"""
+        # Created before the branches share it, not lazily by each of them
+        get_reference_loader({"request": request})
+        deadline = time.monotonic() + settings.SEARCH_BRANCH_TIMEOUT
+        futures = {
+            name: search_executor.submit(run_before, deadline, *branch)
+            for name, branch in branches.items()
+        }
 
-        return sorted_playlists
+        timed_out = []
+        for name, future in futures.items():
+            try:
+                response[name] = future.result(
+                    timeout=max(deadline - time.monotonic(), 0)
+                )
+            except FutureTimeoutError:
+                # Not started yet, or stopped by MongoDB at the deadline
+                future.cancel()
+                timed_out.append(name)
+            except Exception as e:
+                print(f"[SongSearchView] {name} search failed: {e}")
+        return timed_out
 
     def get(self, request):
         query = request.query_params.get("query", "").strip()
         search_type = request.query_params.get("type", "All").strip()
         search_genre = request.query_params.get("genre", "").strip()
+        fuzzy = request.query_params.get("fuzzy", "").lower() in ("1", "true")
+        limit = self.getResultLimit(request)
 
         user_id = request.query_params.get("user_id", "").strip()
         print("user_id", user_id)
@@ -362,21 +520,46 @@ class SongSearchView(APIView):
             return Response({}, status=status.HTTP_200_OK)
 
         if search_type == "All":
-            response["users"] = self.searchUserAndSortByListen(request, query)
-            response["songs"] = self.searchSongAndSortByListen(
-                request, query, search_genre
+            timed_out = self.searchAllConcurrently(
+                request,
+                response,
+                {
+                    "users": (
+                        self.searchUserAndSortByListen,
+                        request,
+                        query,
+                        fuzzy,
+                        limit,
+                    ),
+                    "songs": (
+                        self.searchSongAndSortByListen,
+                        request,
+                        query,
+                        search_genre,
+                        fuzzy,
+                    ),
+                    "playlists": (
+                        self.searchPlaylistAndSortByListen,
+                        request,
+                        query,
+                        limit,
+                    ),
+                },
             )
-            response["playlists"] = self.searchPlaylistAndSortByListen(
-                request, query)
+            if timed_out:
+                response["timed_out"] = timed_out
         elif search_type == "Users":
-            response["users"] = self.searchUserAndSortByListen(request, query)
+            response["users"] = self.searchUserAndSortByListen(
+                request, query, fuzzy, limit
+            )
         elif search_type == "Songs" or (search_type == "Genres" and search_genre):
             response["songs"] = self.searchSongAndSortByListen(
-                request, query, search_genre
+                request, query, search_genre, fuzzy
             )
         elif search_type == "Playlists":
             response["playlists"] = self.searchPlaylistAndSortByListen(
-                request, query)
+                request, query, limit
+            )
 
         return Response(
             response,
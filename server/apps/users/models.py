@@ -3,11 +3,13 @@ from mongoengine import (
     StringField,
     DateTimeField,
     FileField,
+    ListField,
     ValidationError,
 )
 from mongoengine.errors import DoesNotExist
 import datetime
 from mongoengine import Document, StringField, DateTimeField, BooleanField
+from utils.search_text import search_terms, query_terms, relevance, trigrams
 
 
 class User(Document):
@@ -22,8 +24,14 @@ class User(Document):
     deleted_at = DateTimeField(default=None, null=True)
     google_id = StringField()
     is_oauth_user = BooleanField(default=False)
+    search_terms = ListField(StringField())
+    trigrams = ListField(StringField())
 
-    meta = {"collection": "users"}
+    meta = {"collection": "users", "indexes": ["search_terms", "trigrams"]}
+
+    def clean(self):
+        self.search_terms = search_terms(self.name)
+        self.trigrams = trigrams(self.name)
 
     @staticmethod
     def findAllByRoleUser():
@@ -123,6 +131,27 @@ class User(Document):
 
     @staticmethod
     def search(query):
-        if not query or query.strip() == "":
-            return User.objects.none()
-        return User.objects.filter(name__icontains=query, deleted_at=None, role="user")
+        terms = query_terms(query)
+        if not terms:
+            return []
+        users = list(
+            User.objects.filter(search_terms__all=terms, deleted_at=None, role="user")
+        )
+        users.sort(key=lambda user: relevance(user.name, query), reverse=True)
+        return users
+
+    @staticmethod
+    def fuzzySearch(query, limit=20):
+        grams = trigrams(query)
+        if not grams:
+            return []
+        # Imported here: apps.songs.models imports this module
+        from apps.songs.models import TrigramStat
+
+        # Only the rarest trigrams are looked up, see Song.fuzzySearch
+        rows = TrigramStat.similar(
+            User._get_collection(), {"deleted_at": None, "role": "user"}, grams, limit
+        )
+        user_ids = [row["_id"] for row in rows]
+        users = User.objects.in_bulk(user_ids)
+        return [users[user_id] for user_id in user_ids if user_id in users]
@@ -8,6 +8,14 @@ from apps.songs.models import Song
 import datetime
 from bson import ObjectId
 import base64
+from utils.media_urls import media_url, media_version, wants_inline_images
+
+
+def user_image_url(context, user):
+    version = media_version(user, "image")
+    if not version:
+        return None
+    return media_url(context, f"/api/users/{user.pk}/image", version)
 
 
 class UserCreationSerializer(serializers.Serializer):
@@ -39,10 +47,14 @@ class UserListSerializer(serializers.Serializer):
     song_count = serializers.SerializerMethodField()
 
     def get_image(self, obj):
+        if not wants_inline_images(self.context):
+            return user_image_url(self.context, obj)
         try:
             if obj.image and hasattr(obj.image, "grid_id"):
-                grid_file = obj.image.grid_id
-                content = obj.image.read()
+                # Open a fresh GridOut: the same User may be shared by many
+                # songs through the reference loader, and a proxy reads once
+                grid_file = obj.image.fs.get(obj.image.grid_id)
+                content = grid_file.read()
                 base64_data = base64.b64encode(content).decode("utf-8")
                 return f"data:image/jpeg;base64,{base64_data}"
         except Exception as e:
@@ -135,10 +147,14 @@ class UserDetailSerializer(serializers.Serializer):
     deleted_at = serializers.DateTimeField(allow_null=True, read_only=True)
 
     def get_image(self, obj):
+        if not wants_inline_images(self.context):
+            return user_image_url(self.context, obj)
         try:
             if obj.image and hasattr(obj.image, "grid_id"):
-                grid_file = obj.image.grid_id
-                content = obj.image.read()
+                # Open a fresh GridOut: the same User may be shared by many
+                # songs through the reference loader, and a proxy reads once
+                grid_file = obj.image.fs.get(obj.image.grid_id)
+                content = grid_file.read()
                 base64_data = base64.b64encode(content).decode("utf-8")
                 return f"data:image/jpeg;base64,{base64_data}"
         except Exception as e:
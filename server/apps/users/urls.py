@@ -13,6 +13,7 @@ from .views import (
     UserRenderView,
     UserUpdateView,
     UserSearchView,
+    UserImageView,
 )
 
 urlpatterns = [
@@ -28,6 +29,7 @@ urlpatterns = [
     path("<str:user_id>/delete/", UserDeleteView.as_view(), name="admin_user_delete"),
     path("admin/stats/", AdminStatsView.as_view(), name="admin_overall_stats"),
     path("<str:id>", UserDetailView.as_view(), name="user-detail"),
+    path("<str:user_id>/image", UserImageView.as_view(), name="user-image"),
     path("<str:id>/update", UserUpdateView.as_view(), name="user-update"),
     path("<str:id>/delete", UserDeleteView.as_view(), name="user-delete"),
 ]
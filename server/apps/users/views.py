@@ -29,6 +29,12 @@ from rest_framework.generics import (
 )
 from bson import ObjectId
 from rest_framework.exceptions import NotFound
+from utils.cursor_pagination import MongoCursorPagination
+from apps.songs.media import describe_media, serve_media
+
+
+class UserListPagination(MongoCursorPagination):
+    paginate_by_default = False
 
 
 class UserRenderView(ListCreateAPIView):
@@ -110,8 +116,17 @@ class UserListView(APIView):
     def get(self, request):
         try:
             users = User.objects(deleted_at=None)
+
+            paginator = UserListPagination()
+            page = paginator.paginate_queryset(users, request, view=self)
+            if page is not None:
+                serializer = UserDisplaySerializer(page, many=True)
+                return paginator.get_paginated_response(serializer.data)
+
             serializer = UserDisplaySerializer(users, many=True)
             return Response(serializer.data)
+        except NotFound:
+            raise
         except Exception as e:
             return Response(
                 {"error": "An error occurred while fetching users."},
@@ -310,7 +325,9 @@ class UserUpdateView(UpdateAPIView):
         serializer = self.get_serializer(instance, data=request.data, partial=True)
         if serializer.is_valid():
             updated_user = serializer.save()
-            response_serializer = UserDetailSerializer(updated_user)
+            response_serializer = UserDetailSerializer(
+                updated_user, context={"request": request}
+            )
             return Response(response_serializer.data, status=status.HTTP_200_OK)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -348,3 +365,29 @@ class UserSearchView(APIView):
         result = User.search(query)
         serializer = UserCreationSerializer(result, many=True)
         return Response(serializer.data, status=status.HTTP_200_OK)
+
+
+class UserImageView(APIView):
+    """Avatar bytes, linked from serializers with a ?v=<file id> version"""
+
+    permission_classes = [AllowAny]
+
+    def get(self, request, user_id):
+        try:
+            user = User.findById(user_id) if ObjectId.is_valid(user_id) else None
+            if not user:
+                return Response(
+                    {"error": "User not found"}, status=status.HTTP_404_NOT_FOUND
+                )
+
+            descriptor = describe_media(user.to_mongo(), "image")
+            if not descriptor.media_file:
+                return Response(
+                    {"error": "Image not found"}, status=status.HTTP_404_NOT_FOUND
+                )
+            return serve_media(request, descriptor, "image/jpeg")
+
+        except Exception as e:
+            return Response(
+                {"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
@@ -9,16 +9,41 @@ https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
 
 import os
 from django.core.asgi import get_asgi_application
-from channels.routing import ProtocolTypeRouter, URLRouter
-from channels.security.websocket import AllowedHostsOriginValidator
-import apps.chat.routing
 
 # application = get_asgi_application()
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'server.settings')
 
+# Sets Django up, so it has to run before any app module is imported
+django_application = get_asgi_application()
+
+from django.conf import settings
+from django.urls import re_path
+from channels.routing import ProtocolTypeRouter, URLRouter
+from channels.security.websocket import AllowedHostsOriginValidator
+import apps.chat.routing
+from apps.songs.consumers import MediaStreamConsumer
+
+# Audio/video are streamed by an async consumer, everything else goes to Django
+media_routes = []
+if settings.ASYNC_MEDIA_STREAMING:
+    media_routes = [
+        re_path(
+            r"^api/songs/(?P<song_id>[^/]+)/audio$",
+            MediaStreamConsumer.as_asgi(
+                field="audio", default_content_type="audio/mpeg", extension="mp3"
+            ),
+        ),
+        re_path(
+            r"^api/songs/(?P<song_id>[^/]+)/video$",
+            MediaStreamConsumer.as_asgi(
+                field="video", default_content_type="video/mp4", extension="mp4"
+            ),
+        ),
+    ]
+
 application = ProtocolTypeRouter({
-    'http': get_asgi_application(),
+    'http': URLRouter(media_routes + [re_path(r"", django_application)]),
     'websocket': AllowedHostsOriginValidator(
         URLRouter(apps.chat.routing.websocket_urlpatterns)
     ),
@@ -18,6 +18,43 @@ GOOGLE_CLIENT_ID = os.environ.get("GOOGLE_CLIENT_ID")
 GOOGLE_CLIENT_SECRET = os.environ.get("GOOGLE_CLIENT_SECRET")
 GOOGLE_REDIRECT_URI = os.environ.get("GOOGLE_REDIRECT_URI")
 
+# Song search: users/songs/playlists of type=All run in parallel on a shared pool
+SEARCH_MAX_WORKERS = int(os.environ.get("SEARCH_MAX_WORKERS", 12))
+# Seconds a sub-search may take before it is left out of the response
+SEARCH_BRANCH_TIMEOUT = float(os.environ.get("SEARCH_BRANCH_TIMEOUT", 3))
+# Default number of ranked users/playlists returned by a search
+SEARCH_RESULT_LIMIT = int(os.environ.get("SEARCH_RESULT_LIMIT", 20))
+# Fuzzy search skips trigrams held by more than this share of the titles/names
+# so lookups stay bounded on large collections (1 looks up every trigram)
+FUZZY_SEARCH_MAX_TRIGRAM_SHARE = float(
+    os.environ.get("FUZZY_SEARCH_MAX_TRIGRAM_SHARE", 0.02)
+)
+
+# Serve song audio/video from the async consumer under ASGI (see server/asgi.py)
+ASYNC_MEDIA_STREAMING = os.environ.get("ASYNC_MEDIA_STREAMING", "true").lower() == "true"
+# Memory per process for hot GridFS chunks of audio and covers (0 disables the cache)
+MEDIA_CHUNK_CACHE_MB = int(os.environ.get("MEDIA_CHUNK_CACHE_MB", 128))
+# Seconds a song's media descriptor (file id, length, type...) stays cached
+MEDIA_DESCRIPTOR_TTL = int(os.environ.get("MEDIA_DESCRIPTOR_TTL", 60))
+# Backend new song/playlist media is written to: "gridfs" or "filesystem"
+MEDIA_STORAGE_BACKEND = os.environ.get("MEDIA_STORAGE_BACKEND", "gridfs")
+# Root directory of the content-addressed filesystem backend
+MEDIA_BLOB_ROOT = os.environ.get("MEDIA_BLOB_ROOT", str(BASE_DIR / "media_blobs"))
+# Threads shared by all requests to write the media files of a new song at once
+MEDIA_WRITE_MAX_WORKERS = int(os.environ.get("MEDIA_WRITE_MAX_WORKERS", 8))
+# Background jobs (manage.py run_jobs): worker threads, seconds a claimed job
+# stays invisible to other workers, attempts before giving up, first retry delay
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 2))
+JOB_VISIBILITY_TIMEOUT = int(os.environ.get("JOB_VISIBILITY_TIMEOUT", 300))
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", 3))
+JOB_RETRY_DELAY = int(os.environ.get("JOB_RETRY_DELAY", 30))
+# Seconds an idle worker waits before looking for jobs again
+JOB_POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", 1))
+# Seconds between checks for work whose job was never enqueued (job_recovery)
+JOB_RECOVERY_INTERVAL = int(os.environ.get("JOB_RECOVERY_INTERVAL", 300))
+# Hours an unfinished resumable upload is kept before purge_upload_sessions
+UPLOAD_SESSION_TTL_HOURS = int(os.environ.get("UPLOAD_SESSION_TTL_HOURS", 24))
+
 
 INSTALLED_APPS = [
     "corsheaders",
@@ -41,6 +78,7 @@ INSTALLED_APPS = [
     "apps.chat",
     "apps.admin_analytics",
     "apps.user_analytics",
+    "apps.jobs",
     "rest_framework_simplejwt",
 ]
 
@@ -178,4 +216,8 @@ DATABASES = {
 STATIC_URL = "static/"
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
-connect(db="clone_spotify", host="127.0.0.1", port=27017, alias="default")
+MONGO_DB = "clone_spotify"
+MONGO_HOST = "127.0.0.1"
+MONGO_PORT = 27017
+
+connect(db=MONGO_DB, host=MONGO_HOST, port=MONGO_PORT, alias="default")
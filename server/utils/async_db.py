@@ -0,0 +1,14 @@
+from django.conf import settings
+from motor.motor_asyncio import AsyncIOMotorClient
+
+_client = None
+
+
+def get_async_db():
+    """Motor handle on the same database mongoengine is connected to"""
+    global _client
+
+    # Created lazily so the client binds to the running event loop
+    if _client is None:
+        _client = AsyncIOMotorClient(settings.MONGO_HOST, settings.MONGO_PORT)
+    return _client[settings.MONGO_DB]
@@ -0,0 +1,390 @@
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from bson import ObjectId
+from django.conf import settings
+from gridfs import GridFS
+from pymongo import ReturnDocument
+from mongoengine import (
+    Document,
+    EmbeddedDocument,
+    StringField,
+    IntField,
+    DateTimeField,
+    NotUniqueError,
+)
+from mongoengine.connection import get_db
+from mongoengine.fields import GridFSProxy
+
+# Bytes read per step while hashing and copying an upload
+COPY_BUFFER_SIZE = 1024 * 1024
+# Seconds register() waits for the removal of the same content to finish
+# before taking its digest over from a delete() that died halfway
+RELEASE_WAIT = 10
+RELEASE_POLL_INTERVAL = 0.05
+
+_media_write_executor = None
+_media_write_lock = threading.Lock()
+
+
+def get_media_write_executor():
+    """
+    Pool shared by every request so concurrent uploads cannot spawn unbounded
+    threads, sized from MEDIA_WRITE_MAX_WORKERS on first use
+    """
+    global _media_write_executor
+
+    if _media_write_executor is None:
+        with _media_write_lock:
+            if _media_write_executor is None:
+                _media_write_executor = ThreadPoolExecutor(
+                    max_workers=settings.MEDIA_WRITE_MAX_WORKERS,
+                    thread_name_prefix="media-write",
+                )
+    return _media_write_executor
+
+
+class BlobRef(EmbeddedDocument):
+    """Pointer to a media blob kept by one of the storage backends"""
+
+    backend = StringField(required=True, choices=("gridfs", "filesystem"))
+    # GridFS file id, or sha256 hex digest of the content for the filesystem
+    key = StringField(required=True)
+    length = IntField(required=True)
+    content_type = StringField()
+    uploaded_at = DateTimeField(default=datetime.utcnow)
+
+
+def _chunks(content):
+    if hasattr(content, "chunks"):
+        # Django UploadedFile, read from memory or its temporary file
+        yield from content.chunks(COPY_BUFFER_SIZE)
+        return
+    while True:
+        data = content.read(COPY_BUFFER_SIZE)
+        if not data:
+            break
+        yield data
+
+
+class StoredBlob(Document):
+    """
+    Content kept by a backend, shared by every document that uploaded the
+    same bytes. refs counts those documents, the content is removed when
+    it drops to zero.
+    """
+
+    backend = StringField(required=True, choices=("gridfs", "filesystem"))
+    sha256 = StringField(required=True)
+    key = StringField(required=True)
+    length = IntField(required=True)
+    content_type = StringField()
+    refs = IntField(default=1)
+    created_at = DateTimeField(default=datetime.utcnow)
+
+    meta = {
+        "collection": "stored_blobs",
+        "indexes": [
+            {"fields": ("backend", "sha256"), "unique": True},
+            ("backend", "key"),
+        ],
+    }
+
+
+def content_digest(content):
+    """sha256 of content read ahead of writing it, None if it cannot rewind"""
+    seekable = getattr(content, "seekable", None)
+    if not hasattr(content, "seek") or (seekable and not seekable()):
+        return None
+
+    digest = hashlib.sha256()
+    for data in _chunks(content):
+        digest.update(data)
+    content.seek(0)
+    return digest.hexdigest()
+
+
+class BlobBackend:
+    """
+    Deduplicating save/delete on top of the write/remove of each backend.
+
+    Uploads that can be re-read (Django uploads, GridFS files) are hashed
+    first, so content stored already only gains a reference and is not
+    written again. Others are hashed while written and the copy is dropped
+    if the content turns out to be stored.
+    """
+
+    name = None
+    # Whether content stored before the registry may be removed on delete
+    remove_untracked = True
+
+    def save(self, content, content_type=None, filename=None):
+        digest = content_digest(content)
+        if digest:
+            ref = self.acquire(digest)
+            if ref:
+                return ref
+
+        key, length, digest, staged = self.write(content, content_type, filename)
+        return self.store(digest, key, length, content_type, staged)
+
+    def store(self, digest, key, length, content_type, staged=None):
+        """
+        Register written content, then move it into place. Placing it after
+        the registry entry exists means a delete() of the same content that
+        was still running cannot remove it afterwards.
+        """
+        try:
+            ref = self.register(digest, key, length, content_type)
+        except BaseException:
+            self.unstage(staged)
+            raise
+        self.place(ref.key, staged)
+        return ref
+
+    def place(self, key, staged):
+        """Make staged content readable under key, written in place by default"""
+
+    def unstage(self, staged):
+        """Drop staged content that was not registered"""
+
+    def acquire(self, digest):
+        blob = StoredBlob._get_collection().find_one_and_update(
+            {"backend": self.name, "sha256": digest, "refs": {"$gt": 0}},
+            {"$inc": {"refs": 1}},
+        )
+        if not blob:
+            return None
+        return BlobRef(
+            backend=self.name,
+            key=blob["key"],
+            length=blob["length"],
+            content_type=blob.get("content_type"),
+        )
+
+    def register(self, digest, key, length, content_type):
+        blobs = StoredBlob._get_collection()
+        waited = 0
+        while True:
+            try:
+                StoredBlob(
+                    backend=self.name,
+                    sha256=digest,
+                    key=key,
+                    length=length,
+                    content_type=content_type,
+                ).save(force_insert=True)
+                return BlobRef(
+                    backend=self.name,
+                    key=key,
+                    length=length,
+                    content_type=content_type,
+                )
+            except NotUniqueError:
+                # The same content was stored meanwhile
+                ref = self.acquire(digest)
+                if ref:
+                    if ref.key != key:
+                        self.remove(key)
+                    return ref
+                # Its last reference is being released: wait for delete() to
+                # remove the content and then the entry
+                if waited < RELEASE_WAIT:
+                    time.sleep(RELEASE_POLL_INTERVAL)
+                    waited += RELEASE_POLL_INTERVAL
+                    continue
+                blobs.delete_one(
+                    {"backend": self.name, "sha256": digest, "refs": {"$lte": 0}}
+                )
+
+    def delete(self, ref):
+        """Drop one reference, removing the content with the last one"""
+        blobs = StoredBlob._get_collection()
+        blob = blobs.find_one_and_update(
+            {"backend": self.name, "key": ref.key},
+            {"$inc": {"refs": -1}},
+            return_document=ReturnDocument.AFTER,
+        )
+        if blob is None:
+            if self.remove_untracked:
+                self.discard(ref.key)
+            return
+
+        if blob["refs"] <= 0:
+            # The entry outlives the content, so the same content cannot be
+            # stored again until the removal is over (see register())
+            self.discard(ref.key)
+            blobs.delete_one({"_id": blob["_id"], "refs": {"$lte": 0}})
+
+    def discard(self, key):
+        """Remove content along with the cover variants rendered from it"""
+        self.remove(key)
+        remove_variants(key)
+
+
+class GridFSBackend(BlobBackend):
+    name = "gridfs"
+
+    def __init__(self):
+        self.fs = GridFS(get_db())
+
+    def write(self, content, content_type, filename):
+        digest = hashlib.sha256()
+        with self.fs.new_file(content_type=content_type, filename=filename) as grid_in:
+            for data in _chunks(content):
+                digest.update(data)
+                grid_in.write(data)
+        return str(grid_in._id), grid_in.length, digest.hexdigest(), None
+
+    def open(self, ref):
+        return self.fs.get(ObjectId(ref.key))
+
+    def remove(self, key):
+        self.fs.delete(ObjectId(key))
+
+
+class FileSystemBackend(BlobBackend):
+    """
+    Content-addressed blobs under MEDIA_BLOB_ROOT/ab/cd/<sha256>.
+
+    A blob is written to a temporary file and renamed into place once it
+    is registered, so a reader never sees a partial file.
+    """
+
+    name = "filesystem"
+    # Files written before the registry may be shared by several documents
+    remove_untracked = False
+
+    def __init__(self, root=None):
+        self.root = root or settings.MEDIA_BLOB_ROOT
+
+    def path(self, key):
+        return os.path.join(self.root, key[:2], key[2:4], key)
+
+    def write(self, content, content_type, filename):
+        os.makedirs(self.root, exist_ok=True)
+        digest = hashlib.sha256()
+        length = 0
+
+        handle, temp_path = tempfile.mkstemp(dir=self.root, suffix=".part")
+        try:
+            with os.fdopen(handle, "wb") as temp_file:
+                for data in _chunks(content):
+                    digest.update(data)
+                    temp_file.write(data)
+                    length += len(data)
+        except BaseException:
+            self.unstage(temp_path)
+            raise
+
+        key = digest.hexdigest()
+        return key, length, key, temp_path
+
+    def place(self, key, staged):
+        # Same content whether or not the file is there already
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(staged, path)
+
+    def unstage(self, staged):
+        if staged and os.path.exists(staged):
+            os.remove(staged)
+
+    def open(self, ref):
+        return open(self.path(ref.key), "rb")
+
+    def remove(self, key):
+        if os.path.exists(self.path(key)):
+            os.remove(self.path(key))
+
+
+BACKENDS = {
+    GridFSBackend.name: GridFSBackend,
+    FileSystemBackend.name: FileSystemBackend,
+}
+
+
+def get_backend(name=None):
+    """Backend by name, or the one new uploads go to (MEDIA_STORAGE_BACKEND)"""
+    return BACKENDS[name or settings.MEDIA_STORAGE_BACKEND]()
+
+
+def is_upload(value):
+    return hasattr(value, "read") and not isinstance(value, GridFSProxy)
+
+
+def store_uploads(data, fields):
+    """
+    Write the uploaded files of data to the configured backend, all at once
+    on the media write pool, so it takes about as long as the largest file.
+    GridFS files are put back on their FileFields, other backends are
+    referenced from <field>_blob. If one write fails the others are removed
+    before the error is raised.
+
+    Returns the BlobRefs written, for release_blobs() when the document
+    cannot be saved.
+    """
+    backend = get_backend()
+    uploads = {field: data.pop(field) for field in fields if is_upload(data.get(field))}
+    executor = get_media_write_executor()
+    futures = {
+        field: executor.submit(
+            backend.save,
+            upload,
+            content_type=getattr(upload, "content_type", None),
+            filename=getattr(upload, "name", None),
+        )
+        for field, upload in uploads.items()
+    }
+
+    refs = {}
+    error = None
+    for field, future in futures.items():
+        try:
+            refs[field] = future.result()
+        except Exception as e:
+            error = error or e
+    if error:
+        release_blobs(refs.values())
+        raise error
+
+    data.update(media_fields(backend, refs))
+    return list(refs.values())
+
+
+def media_fields(backend, refs):
+    """Document fields pointing at the blobs written by backend ({field: ref})"""
+    if backend.name == GridFSBackend.name:
+        return {
+            field: GridFSProxy(grid_id=ObjectId(ref.key)) for field, ref in refs.items()
+        }
+    return {f"{field}_blob": ref for field, ref in refs.items()}
+
+
+def release_blobs(refs):
+    """Drop a reference to each blob, e.g. written for a document not saved"""
+    for ref in refs:
+        try:
+            get_backend(ref.backend).delete(ref)
+        except Exception as e:
+            print("Error releasing blob:", e)
+
+
+def remove_variants(key):
+    """Drop the resized copies apps/songs/thumbnails.py made of a blob"""
+    fs = GridFS(get_db())
+    for variant in get_db()["fs.files"].find({"metadata.variant_of": key}, {"_id": 1}):
+        fs.delete(variant["_id"])
+
+
+def media_refs(document, field):
+    """Blobs behind a media field: its GridFS FileField and <field>_blob"""
+    refs = [document[f"{field}_blob"]]
+    grid_id = getattr(document[field], "grid_id", None)
+    if grid_id:
+        refs.append(BlobRef(backend=GridFSBackend.name, key=str(grid_id), length=0))
+    return [ref for ref in refs if ref]
@@ -0,0 +1,108 @@
+import base64
+import json
+from datetime import datetime
+from bson import ObjectId
+from bson.errors import InvalidId
+from mongoengine.queryset.visitor import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class MongoCursorPagination(BasePagination):
+    """
+    Keyset pagination for MongoEngine querysets, newest first.
+
+    Pages are ordered by ``ordering_field`` (descending) with ``_id`` as the
+    tie breaker. The cursor stores the last position of the previous page, so
+    every page is an index range scan whatever its depth in the collection.
+    """
+
+    ordering_field = "id"
+    page_size = 50
+    max_page_size = 500
+    page_size_query_param = "limit"
+    cursor_query_param = "cursor"
+    # When False, requests without cursor/limit keep the unpaginated response
+    paginate_by_default = True
+    invalid_cursor_message = "Invalid cursor"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if not self.paginate_by_default and not (
+            self.cursor_query_param in params or self.page_size_query_param in params
+        ):
+            return None
+
+        self.request = request
+        self.page_size = self.get_page_size(request)
+
+        position = self.decode_cursor(request)
+        if position is not None:
+            queryset = queryset.filter(self.after(*position))
+
+        ordering = ["-id"]
+        if self.ordering_field != "id":
+            ordering.insert(0, f"-{self.ordering_field}")
+
+        page = list(queryset.order_by(*ordering).limit(self.page_size + 1))
+        self.has_next = len(page) > self.page_size
+        page = page[: self.page_size]
+
+        self.next_position = None
+        if self.has_next:
+            last = page[-1]
+            self.next_position = (getattr(last, self.ordering_field), last.id)
+        return page
+
+    def after(self, value, last_id):
+        if self.ordering_field == "id":
+            return Q(id__lt=last_id)
+        return Q(**{f"{self.ordering_field}__lt": value}) | Q(
+            **{self.ordering_field: value, "id__lt": last_id}
+        )
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def encode_cursor(self, value, last_id):
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        elif isinstance(value, ObjectId):
+            value = str(value)
+        payload = json.dumps({"value": value, "id": str(last_id)})
+        return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii")
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded.encode("ascii")))
+            last_id = ObjectId(payload["id"])
+            value = payload["value"]
+            if self.ordering_field == "id":
+                value = last_id
+            elif value is not None:
+                value = datetime.fromisoformat(value)
+        except (TypeError, ValueError, KeyError, InvalidId):
+            raise NotFound(self.invalid_cursor_message)
+        return value, last_id
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.page_size_query_param, self.page_size)
+        return replace_query_param(
+            url, self.cursor_query_param, self.encode_cursor(*self.next_position)
+        )
+
+    def get_paginated_response(self, data):
+        return Response({"next": self.get_next_link(), "results": data})
@@ -0,0 +1,28 @@
+def media_version(document, field):
+    """
+    Id of the stored file behind a FileField (or its <field>_blob). It changes
+    whenever the file is replaced, so it is used to version image URLs that
+    are served with immutable caching headers.
+    """
+    ref = getattr(document, f"{field}_blob", None)
+    if ref:
+        return ref.key
+    proxy = document[field]
+    if proxy and getattr(proxy, "grid_id", None):
+        return str(proxy.grid_id)
+    return None
+
+
+def media_url(context, path, version):
+    request = context.get("request")
+    url = f"{path}?v={version}"
+    return request.build_absolute_uri(url) if request else url
+
+
+def wants_inline_images(context):
+    """Base64 data URIs are only sent when asked for with ?inline_images=true"""
+    if context.get("inline_images"):
+        return True
+    request = context.get("request")
+    params = getattr(request, "query_params", getattr(request, "GET", {}))
+    return params.get("inline_images", "").lower() in ("1", "true")
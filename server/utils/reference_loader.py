@@ -0,0 +1,99 @@
+from bson import DBRef
+from mongoengine import Document
+from mongoengine.base.datastructures import BaseList
+from mongoengine.fields import ListField, ReferenceField
+
+
+class ReferenceLoader:
+    """
+    Identity map that resolves ReferenceFields of many documents at once.
+
+    Every referenced id of a collection is fetched with one ``id__in`` query
+    and attached to the owning documents in place, so later attribute access
+    (``song.user``, ``song.genre``...) does not hit MongoDB again.
+    """
+
+    def __init__(self):
+        self._identity_map = {}
+
+    def load(self, documents, *paths):
+        """Resolve dotted reference paths such as "user" or "songs.song.genre"."""
+        documents = [doc for doc in documents if doc is not None]
+        for path in paths:
+            *parents, name = path.split(".")
+            owners = documents
+            for parent in parents:
+                owners = [
+                    child for owner in owners for child in self._values(owner, parent)
+                ]
+            self._load_field(owners, name)
+        return documents
+
+    def _values(self, owner, name):
+        value = owner._data.get(name)
+        if value is None:
+            return []
+        items = value if isinstance(value, (list, tuple)) else [value]
+        return [item for item in items if hasattr(item, "_data")]
+
+    def _load_field(self, owners, name):
+        slots = []
+        pending = {}
+
+        for owner in owners:
+            field = owner._fields.get(name)
+            if isinstance(field, ListField):
+                field = field.field
+            if not isinstance(field, ReferenceField):
+                continue
+
+            document_type = field.document_type
+            cache = self._identity_map.setdefault(document_type, {})
+            value = owner._data.get(name)
+            items = value if isinstance(value, (list, tuple)) else [value]
+
+            for item in items:
+                if isinstance(item, Document):
+                    cache.setdefault(item.pk, item)
+                elif item is not None:
+                    ref_id = item.id if isinstance(item, DBRef) else item
+                    if ref_id not in cache:
+                        pending.setdefault(document_type, set()).add(ref_id)
+
+            slots.append((owner, name, document_type))
+
+        for document_type, ids in pending.items():
+            self._identity_map[document_type].update(
+                document_type.objects.in_bulk(list(ids))
+            )
+
+        for owner, name, document_type in slots:
+            cache = self._identity_map[document_type]
+            value = owner._data.get(name)
+            if isinstance(value, (list, tuple)):
+                # BaseList keeps in-place changes tracked for owner.save()
+                owner._data[name] = BaseList(
+                    [self._resolve(cache, item) for item in value], owner, name
+                )
+            elif value is not None:
+                owner._data[name] = self._resolve(cache, value)
+
+    def _resolve(self, cache, item):
+        if isinstance(item, Document) or item is None:
+            return item
+        ref_id = item.id if isinstance(item, DBRef) else item
+        # Dangling references are left untouched so they still raise DoesNotExist
+        return cache.get(ref_id, item)
+
+
+def get_reference_loader(context):
+    """Return the loader shared by every serializer of the current request"""
+    request = context.get("request")
+    if request is None:
+        return context.setdefault("reference_loader", ReferenceLoader())
+
+    loader = getattr(request, "_reference_loader", None)
+    if loader is None:
+        loader = ReferenceLoader()
+        request._reference_loader = loader
+    return loader
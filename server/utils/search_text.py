@@ -0,0 +1,102 @@
+import math
+import re
+import unicodedata
+
+# Longest word prefix stored in the index, longer query words are truncated
+MAX_PREFIX_LENGTH = 20
+# Minimum trigram similarity for a fuzzy match (same default as pg_trgm)
+SIMILARITY_THRESHOLD = 0.3
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def normalize(text):
+    """Lowercase and strip diacritics, e.g. "Đêm Nay Em Về" -> "dem nay em ve" """
+    text = (text or "").replace("đ", "d").replace("Đ", "D")
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).lower()
+
+
+def tokenize(text):
+    return _WORD_RE.findall(normalize(text))
+
+
+def search_terms(text):
+    """All prefixes of every word, stored in a multikey index for prefix lookups"""
+    terms = set()
+    for word in tokenize(text):
+        for end in range(1, min(len(word), MAX_PREFIX_LENGTH) + 1):
+            terms.add(word[:end])
+    return sorted(terms)
+
+
+def query_terms(query):
+    return [word[:MAX_PREFIX_LENGTH] for word in tokenize(query)]
+
+
+def relevance(text, query):
+    """Score a match: exact > starts with > contains the phrase > whole-word hits"""
+    words = tokenize(text)
+    query_words = tokenize(query)
+    phrase = " ".join(words)
+    query_phrase = " ".join(query_words)
+
+    score = 0
+    if phrase == query_phrase:
+        score += 100
+    elif phrase.startswith(query_phrase):
+        score += 50
+    elif query_phrase in phrase:
+        score += 25
+
+    score += 10 * sum(1 for word in query_words if word in words)
+    return score
+
+
+def trigrams(text):
+    """Padded character trigrams of every word, e.g. "em" -> "  e", " em", "em " """
+    grams = set()
+    for word in tokenize(text):
+        padded = f"  {word} "
+        grams.update(padded[i : i + 3] for i in range(len(padded) - 2))
+    return sorted(grams)
+
+
+def candidate_trigrams(
+    query_trigrams, frequencies, max_frequency=None, threshold=SIMILARITY_THRESHOLD
+):
+    """
+    The query trigrams documents are looked up by. Similarity at least
+    threshold needs k = ceil(threshold * len(query_trigrams)) shared trigrams,
+    so a match always holds one of the len - k + 1 rarest: looking up only
+    those loses nothing. Trigrams held by more than max_frequency documents
+    are dropped too, which can miss matches made of common trigrams only.
+    """
+    # The epsilon keeps 0.3 * 10 = 3.0000000000000004 from rounding up to 4
+    needed = max(1, math.ceil(threshold * len(query_trigrams) - 1e-9))
+    ranked = sorted(query_trigrams, key=lambda gram: (frequencies.get(gram, 0), gram))
+    ranked = ranked[: len(ranked) - needed + 1]
+    if max_frequency is None:
+        return ranked
+    return [
+        gram for gram in ranked if frequencies.get(gram, 0) <= max_frequency
+    ] or ranked[:1]
+
+
+def similarity_pipeline(query_trigrams, limit, threshold=SIMILARITY_THRESHOLD):
+    """Aggregation stages ranking documents by Jaccard similarity of trigrams"""
+    return [
+        {
+            "$project": {
+                "similarity": {
+                    "$divide": [
+                        {"$size": {"$setIntersection": ["$trigrams", query_trigrams]}},
+                        {"$size": {"$setUnion": ["$trigrams", query_trigrams]}},
+                    ]
+                }
+            }
+        },
+        {"$match": {"similarity": {"$gte": threshold}}},
+        {"$sort": {"similarity": -1}},
+        {"$limit": limit},
+    ]
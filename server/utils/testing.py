@@ -0,0 +1,32 @@
+from django.conf import settings
+from django.test import SimpleTestCase
+from mongoengine import connect, disconnect
+from mongoengine.connection import get_connection
+
+TEST_MONGO_DB = f"{settings.MONGO_DB}_test"
+
+
+def _connect(db):
+    disconnect(alias="default")
+    connect(db=db, host=settings.MONGO_HOST, port=settings.MONGO_PORT, alias="default")
+
+
+class MongoTestCase(SimpleTestCase):
+    """
+    Test case run against a throwaway MONGO_DB_test database on the same
+    server, dropped after every test
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        _connect(TEST_MONGO_DB)
+
+    @classmethod
+    def tearDownClass(cls):
+        _connect(settings.MONGO_DB)
+        super().tearDownClass()
+
+    def tearDown(self):
+        get_connection().drop_database(TEST_MONGO_DB)
+        super().tearDown()